@@ -0,0 +1,43 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from timing import best_time
+from src.decoding import decode_rle, decode_sparse_matrix
+from src.optimized_decoding import decode_rle_optimized, decode_sparse_matrix_optimized
+from src.optimized_encoding import encode_rle_optimized, encode_sparse_matrix_optimized
+from src.generation import generate_blob, generate_dye_distribution
+
+def report(name, seconds, reference):
+    print(f"{name:<44} {seconds * 1e3:9.3f} ms  {reference / seconds:8.1f}x")
+
+def main(repeats=20):
+    np.random.seed(0)
+    blob = generate_blob()
+    dye = generate_dye_distribution(blob)
+    shape = blob.shape
+    rle = encode_rle_optimized(blob)
+    # decode_rle accumulates its offset in the RLE dtype, so give it int64 run lengths
+    rle_wide = rle.astype(np.int64)
+    sparse = encode_sparse_matrix_optimized(dye)
+    buffer = np.empty(shape, dtype=np.uint8)
+
+    print(f"RLE: {rle.size // 2} runs, {shape[0]}x{shape[1]}")
+    baseline = best_time(lambda: decode_rle(rle_wide, shape), 3)
+    report("decode_rle", baseline, baseline)
+    report("decode_rle_optimized", best_time(lambda: decode_rle_optimized(rle, shape), repeats), baseline)
+    report("decode_rle_optimized(out=buffer)",
+           best_time(lambda: decode_rle_optimized(rle, shape, out=buffer), repeats), baseline)
+
+    print(f"Sparse: {len(sparse)} entries")
+    baseline = best_time(lambda: decode_sparse_matrix(sparse, shape), 1)
+    report("decode_sparse_matrix", baseline, baseline)
+    report("decode_sparse_matrix_optimized",
+           best_time(lambda: decode_sparse_matrix_optimized(sparse, shape), repeats), baseline)
+    report("decode_sparse_matrix_optimized(out=buffer)",
+           best_time(lambda: decode_sparse_matrix_optimized(sparse, shape, out=buffer), repeats), baseline)
+
+if __name__ == "__main__":
+    main()
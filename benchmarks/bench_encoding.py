@@ -0,0 +1,29 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from timing import best_time
+from src.encoding import encode_rle
+from src.optimized_encoding import encode_rle_optimized
+from src.generation import generate_blob
+
+# Minimum throughput expected from encode_rle_optimized on a 1000x1000 mask
+TARGET_PIXELS_PER_SECOND = 200e6
+
+def main(repeats=20):
+    np.random.seed(0)
+    blob = generate_blob()
+    assert np.array_equal(encode_rle(blob), encode_rle_optimized(blob))
+
+    baseline = best_time(lambda: encode_rle(blob), 1)
+    optimized = best_time(lambda: encode_rle_optimized(blob), repeats)
+    optimized_pps = blob.size / optimized
+    print(f"encode_rle:           {baseline * 1e3:9.2f} ms  {blob.size / baseline / 1e6:9.1f} Mpx/s")
+    print(f"encode_rle_optimized: {optimized * 1e3:9.2f} ms  {optimized_pps / 1e6:9.1f} Mpx/s")
+    print(f"speedup: {baseline / optimized:.0f}x, target {TARGET_PIXELS_PER_SECOND / 1e6:.0f} Mpx/s")
+    return optimized_pps >= TARGET_PIXELS_PER_SECOND
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,35 @@
+import argparse
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from timing import best_time
+from src.optimized_cancerDetection import count_dye_in_blob_parallel, has_cancer_dye_optimized
+from src.optimized_decoding import decode_encoded_optimized
+from src.optimized_generation import generate_blob, generate_dye_distribution
+
+def main(width, height, max_workers, repeats):
+    rows = generate_blob((height // 5, height // 3), width, height, output='rows', rng=0)
+    blob = decode_encoded_optimized(rows, dtype=bool)
+    dye_distribution = decode_encoded_optimized(generate_dye_distribution(rows, output='csr', rng=0), dtype=bool)
+    expected = (int(np.sum(blob)), int(np.sum(dye_distribution & blob)))
+
+    serial = best_time(lambda: has_cancer_dye_optimized(dye_distribution, blob), repeats)
+    print(f"{width}x{height}, {os.cpu_count()} CPUs")
+    print(f"has_cancer_dye_optimized:        {serial * 1e3:9.2f} ms")
+    for workers in range(1, max_workers + 1):
+        assert count_dye_in_blob_parallel(dye_distribution, blob, workers) == expected
+        seconds = best_time(lambda: count_dye_in_blob_parallel(dye_distribution, blob, workers), repeats)
+        print(f"count_dye_in_blob_parallel, {workers:2} workers: {seconds * 1e3:9.2f} ms  "
+              f"speedup {serial / seconds:5.2f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the tiled multi-threaded dye detector.")
+    parser.add_argument('--width', type=int, default=16384)
+    parser.add_argument('--height', type=int, default=4096)
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count())
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+    main(args.width, args.height, args.max_workers, args.repeats)
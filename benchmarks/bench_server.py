@@ -0,0 +1,142 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.optimized_generation import generate_blob, generate_dye_distribution
+from src.optimized_server import DEFAULT_PORT, pack_request, score_request
+
+def make_bodies(samples, width, height, seed):
+    """
+    Generate `samples` microscope/dye pairs and return their request bodies. The blob radii
+    scale with the image, matching the default (100, 400) at 1000x1000.
+    """
+    size = min(width, height)
+    bodies = []
+    for rng in np.random.default_rng(seed).spawn(samples):
+        blob = generate_blob((size // 10, size * 2 // 5), width, height, output='rows', rng=rng)
+        dye = generate_dye_distribution(blob, output='csr', rng=rng)
+        bodies.append(pack_request(blob, dye))
+    return bodies
+
+async def open_connection(address):
+    if isinstance(address, str):
+        return await asyncio.open_unix_connection(address)
+    return await asyncio.open_connection(*address)
+
+async def post(reader, writer, body):
+    """
+    Send one `POST /score` on an open connection and return the status and decoded JSON.
+    """
+    writer.write(f"POST /score HTTP/1.1\r\nContent-Length: {len(body)}\r\n\r\n".encode('latin-1') + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+async def load_test(address, bodies, requests, concurrency):
+    """
+    Send `requests` requests over `concurrency` keep-alive connections, each sending its
+    next request as soon as the previous one is answered.
+
+    Returns:
+    - tuple: `(latencies, errors, seconds, first_results)`, the latency in seconds of every
+      successful request, the number of failures, the wall time of the whole test and the
+      result returned for each body the first time it was sent.
+    """
+    latencies, errors, first_results = [], 0, {}
+    next_request = iter(range(requests))
+
+    async def connection():
+        nonlocal errors
+        reader, writer = await open_connection(address)
+        try:
+            for i in next_request:
+                start = time.perf_counter()
+                status, result = await post(reader, writer, bodies[i % len(bodies)])
+                if status == 200:
+                    latencies.append(time.perf_counter() - start)
+                    first_results.setdefault(i % len(bodies), result)
+                else:
+                    errors += 1
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(connection() for _ in range(concurrency)))
+    return np.array(latencies), errors, time.perf_counter() - start, first_results
+
+async def wait_for_server(address, timeout=30.0):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            _, writer = await open_connection(address)
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+        else:
+            writer.close()
+            return
+
+def main(args):
+    address = args.unix if args.unix else (args.host, args.port)
+    server = None
+    if args.spawn:
+        command = [sys.executable, '-m', 'src.optimized_server', '--max-batch', str(args.max_batch),
+                   '--max-delay-ms', str(args.max_delay_ms)]
+        command += ['--unix', args.unix] if args.unix else ['--host', args.host, '--port', str(args.port)]
+        command += ['--workers', str(args.workers)] if args.workers else []
+        command += ['--threads'] if args.threads else []
+        server = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL)
+    try:
+        bodies = make_bodies(args.samples, args.width, args.height, args.seed)
+        asyncio.run(wait_for_server(address))
+        latencies, errors, seconds, first_results = asyncio.run(
+            load_test(address, bodies, args.requests, args.concurrency))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    mismatches = sum(first_results[i] != score_request(bodies[i]) for i in first_results)
+    print(f"{args.requests} requests of {args.width}x{args.height} over {args.concurrency} connections, "
+          f"{len(bodies)} distinct samples of {np.mean([len(body) for body in bodies]) / 1e3:.1f} KB")
+    if latencies.size:
+        print(f"latency p50 {np.percentile(latencies, 50) * 1e3:8.2f} ms   "
+              f"p99 {np.percentile(latencies, 99) * 1e3:8.2f} ms   "
+              f"max {latencies.max() * 1e3:8.2f} ms")
+    print(f"throughput {latencies.size / seconds:8.1f} requests/s, {errors} errors, "
+          f"{mismatches} results differing from local scoring")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the scoring server.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix', metavar='PATH', help="connect to a Unix socket instead of TCP")
+    parser.add_argument('--spawn', action='store_true', help="start a server for the test and stop it after")
+    parser.add_argument('--workers', type=int, default=None, help="server workers, with --spawn")
+    parser.add_argument('--threads', action='store_true', help="server thread pool, with --spawn")
+    parser.add_argument('--max-batch', type=int, default=16, help="server batch size, with --spawn")
+    parser.add_argument('--max-delay-ms', type=float, default=2.0, help="server batch delay, with --spawn")
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--samples', type=int, default=16)
+    parser.add_argument('--width', type=int, default=1000)
+    parser.add_argument('--height', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    main(parser.parse_args())
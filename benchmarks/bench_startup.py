@@ -0,0 +1,51 @@
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Prints whether matplotlib was loaded by importing the pipeline
+IMPORT_CHECK = "import sys, optimized_main; print('matplotlib' in sys.modules)"
+
+def time_command(args, repeats, cwd=ROOT):
+    """
+    Run a command `repeats` times in fresh interpreters.
+
+    Returns:
+    - tuple: `(median_seconds, last_stdout)`, or `(None, error output)` if the command failed.
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    times, stdout = [], ''
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = subprocess.run(args, cwd=cwd, env=env, capture_output=True, text=True)
+        times.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            return None, result.stderr.strip().splitlines()[-1]
+        stdout = result.stdout
+    return statistics.median(times), stdout
+
+def main(repeats=10):
+    bare, _ = time_command([sys.executable, '-c', 'import numpy'], repeats)
+    imported, loaded = time_command([sys.executable, '-c', IMPORT_CHECK], repeats)
+    plotting, error = time_command([sys.executable, '-c', 'import matplotlib.pyplot'], repeats)
+    with tempfile.TemporaryDirectory() as work_dir:
+        headless, output = time_command([sys.executable, os.path.join(ROOT, 'optimized_main.py'), '--headless'],
+                                         repeats, cwd=work_dir)
+    print(f"python + numpy:                   {bare * 1e3:8.1f} ms")
+    print(f"import optimized_main:            {imported * 1e3:8.1f} ms  matplotlib loaded: {loaded.strip()}")
+    if plotting is not None:
+        print(f"import matplotlib.pyplot:         {plotting * 1e3:8.1f} ms  (avoided by headless runs)")
+    else:
+        print(f"import matplotlib.pyplot:         unavailable ({error})")
+    if headless is None:
+        print(f"optimized_main.py --headless:     failed ({output})")
+        return False
+    print(f"optimized_main.py --headless:     {headless * 1e3:8.1f} ms  (1000x1000, end to end)")
+    return loaded.strip() == 'False'
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,42 @@
+import json
+import os
+import sys
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from timing import best_time
+from src.optimized_encoding import encode_rle_optimized, encode_sparse_matrix_optimized
+from src.generation import generate_blob, generate_dye_distribution
+from src.storage import compact, save_encoded, load_encoded
+
+def load_json(path):
+    with open(path) as f:
+        return np.array(json.load(f))
+
+def main(repeats=5):
+    np.random.seed(0)
+    blob = generate_blob()
+    encoded = {
+        'rle': encode_rle_optimized(blob),
+        'sparse': encode_sparse_matrix_optimized(generate_dye_distribution(blob)),
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for kind, array in encoded.items():
+            json_path = os.path.join(tmp, kind + '.json')
+            bin_path = os.path.join(tmp, kind + '.bin')
+            with open(json_path, 'w') as f:
+                json.dump(array.tolist(), f)
+            save_encoded(bin_path, kind, blob.shape, {kind: compact(array)})
+
+            print(f"{kind}: {array.shape} {array.dtype}")
+            print(f"  json   {os.path.getsize(json_path):>10} bytes  "
+                  f"{best_time(lambda: load_json(json_path), repeats) * 1e3:9.3f} ms")
+            print(f"  binary {os.path.getsize(bin_path):>10} bytes  "
+                  f"{best_time(lambda: load_encoded(bin_path), repeats) * 1e3:9.3f} ms (mmap + checksum)")
+            print(f"  binary {'':>10}        "
+                  f"{best_time(lambda: load_encoded(bin_path, verify=False), repeats) * 1e3:9.3f} ms (mmap only)")
+
+if __name__ == "__main__":
+    main()
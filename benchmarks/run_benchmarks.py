@@ -0,0 +1,219 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src import generation, encoding, decoding, cancer_detection
+from src import optimized_generation, optimized_encoding, optimized_decoding, optimized_cancerDetection
+from src.optimized_encoding import EncodedImage
+from timing import best_time
+
+# Functions that loop over pixels or entries in Python only run up to this many pixels
+BASELINE_MAX_PIXELS = 1024 * 1024
+# Functions that need dense images (or dense temporaries) only run up to this many pixels
+DENSE_MAX_PIXELS = 4096 * 4096
+
+@contextlib.contextmanager
+def baseline_image_size(width, height):
+    """
+    Temporarily set the module-level WIDTH and HEIGHT that src.generation is hard-wired to,
+    so the baseline generators can be measured at other sizes.
+    """
+    saved = generation.WIDTH, generation.HEIGHT
+    generation.WIDTH, generation.HEIGHT = width, height
+    try:
+        yield
+    finally:
+        generation.WIDTH, generation.HEIGHT = saved
+
+def encoded_nbytes(value):
+    """
+    Return the number of bytes held by an encoder's output, or None for other outputs.
+    """
+    if isinstance(value, EncodedImage):
+        return int(sum(array.nbytes for array in value.arrays.values()))
+    if isinstance(value, np.ndarray) and value.ndim <= 2 and value.dtype != np.bool_:
+        return int(value.nbytes)
+    return None
+
+def measure(func, repeats):
+    """
+    Run `func` once under tracemalloc for its peak allocation, then `repeats` times for
+    its best wall time.
+
+    Returns:
+    - tuple: `(seconds, peak_bytes, result)`.
+    """
+    tracemalloc.start()
+    result = func()
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best_time(func, repeats), peak_bytes, result
+
+def build_cases(size, dye_ratio, radius, seed):
+    """
+    Build the inputs for one configuration and list every function to benchmark on them.
+
+    Returns:
+    - list of tuple: `(family, stage, name, limit, func)` where `limit` is the largest image
+      (in pixels) the function is run on.
+    """
+    shape = (size, size)
+    radius_range = (radius, radius + 1)
+    rows_blob = optimized_generation.generate_blob(radius_range, size, size, output='rows', rng=seed)
+    csr_dye = optimized_generation.generate_dye_distribution(rows_blob, dye_ratio, output='csr', rng=seed)
+    rle = optimized_encoding.rows_to_rle(rows_blob)
+    rle_wide = rle.astype(np.int64)
+    dense = size * size <= DENSE_MAX_PIXELS
+    blob = optimized_decoding.decode_encoded_optimized(rows_blob, dtype=bool) if dense else None
+    dye = optimized_decoding.decode_encoded_optimized(csr_dye, dtype=bool) if dense else None
+    sparse = optimized_encoding.encode_sparse_matrix_optimized(dye) if dense else None
+    auto_dye = optimized_encoding.encode_dye_optimized(dye) if dense else csr_dye
+    everything = float('inf')
+
+    def seeded(func):
+        def run():
+            np.random.seed(seed)
+            return func()
+        return run
+
+    def baseline_generator(func):
+        def run():
+            with baseline_image_size(size, size):
+                np.random.seed(seed)
+                return func()
+        return run
+
+    return [
+        ('baseline', 'generate', 'generation.generate_blob', DENSE_MAX_PIXELS,
+         baseline_generator(lambda: generation.generate_blob(radius_range))),
+        ('baseline', 'generate', 'generation.generate_dye_distribution', DENSE_MAX_PIXELS,
+         baseline_generator(lambda: generation.generate_dye_distribution(blob, dye_ratio))),
+        ('baseline', 'encode', 'encoding.encode_rle', BASELINE_MAX_PIXELS,
+         lambda: encoding.encode_rle(blob)),
+        ('baseline', 'encode', 'encoding.encode_sparse_matrix', DENSE_MAX_PIXELS,
+         lambda: encoding.encode_sparse_matrix(dye)),
+        ('baseline', 'decode', 'decoding.decode_rle', BASELINE_MAX_PIXELS,
+         lambda: decoding.decode_rle(rle_wide, shape)),
+        ('baseline', 'decode', 'decoding.decode_sparse_matrix', BASELINE_MAX_PIXELS,
+         lambda: decoding.decode_sparse_matrix(sparse, shape)),
+        ('baseline', 'detect', 'cancer_detection.has_cancer_microscope', DENSE_MAX_PIXELS,
+         lambda: cancer_detection.has_cancer_microscope(blob)),
+        ('baseline', 'detect', 'cancer_detection.has_cancer_dye', DENSE_MAX_PIXELS,
+         lambda: cancer_detection.has_cancer_dye(dye, blob)),
+
+        ('optimized', 'generate', 'optimized_generation.generate_blob', DENSE_MAX_PIXELS,
+         seeded(lambda: optimized_generation.generate_blob(radius_range, size, size))),
+        ('optimized', 'generate', "optimized_generation.generate_blob(output='rows')", everything,
+         lambda: optimized_generation.generate_blob(radius_range, size, size, output='rows', rng=seed)),
+        ('optimized', 'generate', 'optimized_generation.generate_dye_distribution', DENSE_MAX_PIXELS,
+         seeded(lambda: optimized_generation.generate_dye_distribution(blob, dye_ratio))),
+        ('optimized', 'generate', "optimized_generation.generate_dye_distribution(output='csr')", everything,
+         lambda: optimized_generation.generate_dye_distribution(rows_blob, dye_ratio, output='csr', rng=seed)),
+        ('optimized', 'encode', 'optimized_encoding.encode_rle_optimized', DENSE_MAX_PIXELS,
+         lambda: optimized_encoding.encode_rle_optimized(blob)),
+        ('optimized', 'encode', 'optimized_encoding.encode_rle_rows_optimized', DENSE_MAX_PIXELS,
+         lambda: optimized_encoding.encode_rle_rows_optimized(blob)),
+        ('optimized', 'encode', 'optimized_encoding.encode_sparse_matrix_optimized', DENSE_MAX_PIXELS,
+         lambda: optimized_encoding.encode_sparse_matrix_optimized(dye)),
+        ('optimized', 'encode', 'optimized_encoding.encode_sparse_csr_optimized', DENSE_MAX_PIXELS,
+         lambda: optimized_encoding.encode_sparse_csr_optimized(dye)),
+        ('optimized', 'encode', 'optimized_encoding.encode_dye_optimized', DENSE_MAX_PIXELS,
+         lambda: optimized_encoding.encode_dye_optimized(dye)),
+        ('optimized', 'decode', 'optimized_decoding.decode_rle_optimized', DENSE_MAX_PIXELS,
+         lambda: optimized_decoding.decode_rle_optimized(rle, shape)),
+        ('optimized', 'decode', 'optimized_decoding.decode_sparse_matrix_optimized', DENSE_MAX_PIXELS,
+         lambda: optimized_decoding.decode_sparse_matrix_optimized(sparse, shape)),
+        ('optimized', 'decode', 'optimized_decoding.decode_sparse_matrix_optimized(auto)', DENSE_MAX_PIXELS,
+         lambda: optimized_decoding.decode_sparse_matrix_optimized(auto_dye, shape)),
+        ('optimized', 'detect', 'optimized_cancerDetection.has_cancer_microscope_optimized', DENSE_MAX_PIXELS,
+         lambda: optimized_cancerDetection.has_cancer_microscope_optimized(blob)),
+        ('optimized', 'detect', 'optimized_cancerDetection.has_cancer_dye_optimized', DENSE_MAX_PIXELS,
+         lambda: optimized_cancerDetection.has_cancer_dye_optimized(dye, blob)),
+        ('optimized', 'detect', 'optimized_cancerDetection.has_cancer_microscope_encoded', everything,
+         lambda: optimized_cancerDetection.has_cancer_microscope_encoded(rle, shape)),
+        ('optimized', 'detect', 'optimized_cancerDetection.has_cancer_dye_encoded', everything,
+         lambda: optimized_cancerDetection.has_cancer_dye_encoded(auto_dye, rle, shape)),
+    ]
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(sizes, dye_ratios, radius_fractions, repeats, seed, only=None):
+    """
+    Benchmark every function on every combination of size, dye ratio and blob radius.
+
+    Returns:
+    - list of dict: One record per function and configuration.
+    """
+    records = []
+    for size in sizes:
+        for dye_ratio in dye_ratios:
+            for radius_fraction in radius_fractions:
+                radius = max(1, int(size * radius_fraction))
+                cases = build_cases(size, dye_ratio, radius, seed)
+                for family, stage, name, limit, func in cases:
+                    if only and only not in name:
+                        continue
+                    record = {'family': family, 'stage': stage, 'function': name, 'size': size,
+                              'dye_ratio': dye_ratio, 'radius': radius}
+                    if size * size > limit:
+                        record['skipped'] = f"above {limit} pixels"
+                    else:
+                        seconds, peak_bytes, result = measure(func, repeats)
+                        record.update(seconds=seconds, peak_bytes=peak_bytes,
+                                      megapixels_per_second=size * size / seconds / 1e6,
+                                      encoded_bytes=encoded_nbytes(result) if stage in ('encode', 'generate') else None)
+                    records.append(record)
+                    print(f"{size:>6} {dye_ratio:<5} {radius:>6} {name:<66} "
+                          + (record['skipped'] if 'skipped' in record else
+                             f"{record['seconds'] * 1e3:10.3f} ms {record['peak_bytes'] / 2**20:9.2f} MiB"),
+                          flush=True)
+    return records
+
+def main():
+    global BASELINE_MAX_PIXELS, DENSE_MAX_PIXELS
+    parser = argparse.ArgumentParser(description="Benchmark the baseline and optimized modules.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[256, 1024, 4096, 16384])
+    parser.add_argument('--dye-ratios', type=float, nargs='+', default=[0.01, 0.1])
+    parser.add_argument('--radius-fractions', type=float, nargs='+', default=[0.15, 0.35],
+                        help="blob radius as a fraction of the image side")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', help="run only functions whose name contains this text")
+    parser.add_argument('--baseline-max-pixels', type=int, default=BASELINE_MAX_PIXELS)
+    parser.add_argument('--dense-max-pixels', type=int, default=DENSE_MAX_PIXELS)
+    parser.add_argument('--output', default='benchmark_results.json')
+    args = parser.parse_args()
+    BASELINE_MAX_PIXELS, DENSE_MAX_PIXELS = args.baseline_max_pixels, args.dense_max_pixels
+
+    records = run(args.sizes, args.dye_ratios, args.radius_fractions, args.repeats, args.seed, args.only)
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'parameters': vars(args),
+        'results': records,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f"Wrote {len(records)} results to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+import time
+
+def best_time(func, repeats):
+    """
+    Return the best wall time in seconds of `repeats` calls of `func()`.
+    """
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
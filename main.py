@@ -1,9 +1,9 @@
 import os
-import json
 from src.encoding import encode_rle, encode_sparse_matrix
 from src.decoding import decode_rle, decode_sparse_matrix
 from src.generation import generate_blob, generate_dye_distribution
 from src.visualization import visualize_image
+from src.storage import compact, save_encoded, load_encoded
 from src.cancer_detection import has_cancer_dye, has_cancer_microscope
 
 # Define image dimensions
@@ -22,12 +22,14 @@ dye_distribution = generate_dye_distribution(blob)
 rle_blob = encode_rle(blob)
 sparse_dye = encode_sparse_matrix(dye_distribution)
 
-# Save the encoded images
-with open(os.path.join(data_dir, 'microscope.json'), 'w') as f:
-    json.dump(rle_blob.tolist(), f)
+# Save the encoded images, the int64 sparse matrix downcast to the smallest dtype that holds
+# its coordinates so the container stays smaller than the JSON it replaced
+save_encoded(os.path.join(data_dir, 'microscope.bin'), 'rle', (HEIGHT, WIDTH), {'rle': rle_blob})
+save_encoded(os.path.join(data_dir, 'dye_sensor.bin'), 'sparse', (HEIGHT, WIDTH), {'sparse': compact(sparse_dye)})
 
-with open(os.path.join(data_dir, 'dye_sensor.json'), 'w') as f:
-    json.dump(sparse_dye.tolist(), f)
+# Load the encoded images back from disk
+rle_blob = load_encoded(os.path.join(data_dir, 'microscope.bin'))[2]['rle']
+sparse_dye = load_encoded(os.path.join(data_dir, 'dye_sensor.bin'))[2]['sparse']
 
 # Decode the images
 decoded_microscope_image = decode_rle(rle_blob, (HEIGHT, WIDTH))
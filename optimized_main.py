@@ -1,29 +1,110 @@
+import argparse
 import os
-import json
-from src.optimized_encoding import encode_rle_optimized, encode_sparse_matrix_optimized
+from src.optimized_encoding import EncodedImage, encode_rle_optimized, encode_dye_optimized
 from src.optimized_decoding import decode_rle_optimized, decode_sparse_matrix_optimized
 from src.optimized_generation import generate_blob, generate_dye_distribution
 from src.optimized_visualization import visualize_image_optimized
-from src.optimized_cancerDetection import has_cancer_dye_optimized, has_cancer_microscope_optimized
+from src.storage import save_encoded, load_encoded
+from src.optimized_cancerDetection import has_cancer_dye_encoded, has_cancer_microscope_encoded
+from src.optimized_pipeline import DEFAULT_TILE_BUDGET, run_streaming
+from src.optimized_batch import score_batch
+from src.optimized_preview import PreviewWriter
+from src.optimized_pyramid import build_pyramid, save_pyramid
+from src.instrumentation import enable, enable_from_env, finish, stage
 
-def main(data_dir='data', width=1000, height=1000):
+def main(data_dir='data', width=1000, height=1000, headless=False, preview_dir=None, pyramid=False):
     os.makedirs(data_dir, exist_ok=True)
-    blob = generate_blob()
-    dye_distribution = generate_dye_distribution(blob)
-    rle_blob = encode_rle_optimized(blob)
-    sparse_dye = encode_sparse_matrix_optimized(dye_distribution)
-    with open(os.path.join(data_dir, 'microscope.json'), 'w') as f:
-        json.dump(rle_blob.tolist(), f)
-    with open(os.path.join(data_dir, 'dye_sensor.json'), 'w') as f:
-        json.dump(sparse_dye.tolist(), f)
-    decoded_microscope_image = decode_rle_optimized(rle_blob, (height, width))
-    decoded_dye_image = decode_sparse_matrix_optimized(sparse_dye, (height, width))
-    visualize_image_optimized(decoded_microscope_image, 'Microscope Image', show_image=True, save_image=False)
-    visualize_image_optimized(decoded_dye_image, 'Dye Sensor Image', show_image=True, save_image=False)
-    cancer_microscope = has_cancer_microscope_optimized(decoded_microscope_image)
-    cancer_dye = has_cancer_dye_optimized(decoded_dye_image, decoded_microscope_image) if cancer_microscope else False
+    previews = PreviewWriter() if preview_dir is not None else None
+    shape = (height, width)
+    microscope_path = os.path.join(data_dir, 'microscope.bin')
+    dye_path = os.path.join(data_dir, 'dye_sensor.bin')
+    with stage('generate_blob') as s:
+        blob = s.output(generate_blob(width=width, height=height))
+    with stage('generate_dye', blob) as s:
+        dye_distribution = s.output(generate_dye_distribution(blob))
+    with stage('encode_rle', blob) as s:
+        rle_blob = s.output(encode_rle_optimized(blob))
+    with stage('encode_dye', dye_distribution) as s:
+        sparse_dye = s.output(encode_dye_optimized(dye_distribution))
+    if previews is not None:
+        # Rendered from the encodings on a background thread while the pipeline goes on
+        previews.submit(rle_blob, os.path.join(preview_dir, 'microscope.png'), shape=shape, title='Microscope Image')
+        previews.submit(sparse_dye, os.path.join(preview_dir, 'dye_sensor.png'), title='Dye Sensor Image')
+    with stage('save', (rle_blob, sparse_dye)):
+        save_encoded(microscope_path, 'rle', shape, {'rle': rle_blob})
+        save_encoded(dye_path, sparse_dye.format, shape, sparse_dye.arrays)
+    if pyramid:
+        with stage('pyramid', (rle_blob, sparse_dye)):
+            save_pyramid(os.path.join(data_dir, 'microscope.pyramid.bin'), build_pyramid(rle_blob, shape))
+            save_pyramid(os.path.join(data_dir, 'dye_sensor.pyramid.bin'), build_pyramid(sparse_dye))
+    with stage('load') as s:
+        rle_blob = load_encoded(microscope_path)[2]['rle']
+        sparse_dye = EncodedImage(*load_encoded(dye_path))
+        s.output((rle_blob, sparse_dye))
+    if not headless:
+        # The images are only decoded to be displayed; detection runs on the encodings
+        with stage('decode', (rle_blob, sparse_dye)) as s:
+            decoded_microscope_image = decode_rle_optimized(rle_blob, shape)
+            decoded_dye_image = decode_sparse_matrix_optimized(sparse_dye, shape)
+            s.output((decoded_microscope_image, decoded_dye_image))
+        with stage('visualize', (decoded_microscope_image, decoded_dye_image)):
+            visualize_image_optimized(decoded_microscope_image, 'Microscope Image', show_image=True, save_image=False)
+            visualize_image_optimized(decoded_dye_image, 'Dye Sensor Image', show_image=True, save_image=False)
+    with stage('detect', (rle_blob, sparse_dye)):
+        cancer_microscope = has_cancer_microscope_encoded(rle_blob, shape)
+        cancer_dye = has_cancer_dye_encoded(sparse_dye, rle_blob, shape) if cancer_microscope else False
     print("Has cancer (Microscope Image):", cancer_microscope)
     print("Has cancer (Dye Sensor Image):", cancer_dye)
+    if previews is not None:
+        with stage('preview'):
+            print("Previews written:", ', '.join(previews.close()))
+    return {'cancer_microscope': bool(cancer_microscope), 'cancer_dye': bool(cancer_dye)}
+
+def main_streaming(width=1000, height=1000, tile_budget=DEFAULT_TILE_BUDGET, seed=None):
+    with stage('streaming'):
+        result = run_streaming(width, height, tile_budget=tile_budget, seed=seed)
+    print(f"Processed {result['bands']} bands of {result['band_rows']} rows")
+    print("Has cancer (Microscope Image):", result['cancer_microscope'])
+    print("Has cancer (Dye Sensor Image):", result['cancer_dye'])
+    return result
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=1000)
+    parser.add_argument('--height', type=int, default=1000)
+    parser.add_argument('--stream', action='store_true',
+                        help="generate and score the images band by band with bounded memory")
+    parser.add_argument('--tile-budget-mb', type=float, default=DEFAULT_TILE_BUDGET / 2**20,
+                        help="memory budget for one band in streaming mode")
+    parser.add_argument('--seed', type=int, default=None, help="seed for streaming mode")
+    parser.add_argument('--batch', metavar='SOURCE',
+                        help="score every sample of a manifest (JSONL) or directory of encoded pairs")
+    parser.add_argument('--report', default='report.jsonl', help="batch report path (.jsonl or .csv)")
+    parser.add_argument('--workers', type=int, default=None, help="batch worker processes")
+    parser.add_argument('--decode', action='store_true', help="decode images in batch mode")
+    parser.add_argument('--headless', action='store_true',
+                        help="skip decoding and plotting the full images; without --preview, "
+                             "matplotlib is never imported")
+    parser.add_argument('--preview', metavar='DIR',
+                        help="write downsampled PNG previews rendered from the encodings to DIR")
+    parser.add_argument('--pyramid', action='store_true',
+                        help="also store 1/2 to 1/1024 scale coverage pyramids in the data directory")
+    parser.add_argument('--metrics', nargs='?', const='-', metavar='PATH',
+                        help="record per-stage timing and memory and append a JSON record to PATH "
+                             "(stderr if omitted); also enabled by the DRAGONFRUIT_METRICS variable")
+    args = parser.parse_args()
+    if args.metrics:
+        enable(args.metrics, **vars(args))
+    else:
+        enable_from_env(**vars(args))
+    if args.batch:
+        with stage('batch'):
+            summary = score_batch(args.batch, args.report, workers=args.workers, decode=args.decode)
+        print(f"Scored {summary['samples']} samples ({summary['errors']} errors) in {summary['seconds']:.2f} s, "
+              f"{summary['samples_per_second']:.1f} samples/s; report written to {args.report}")
+        finish(**summary)
+    elif args.stream:
+        finish(**main_streaming(args.width, args.height, int(args.tile_budget_mb * 2**20), args.seed))
+    else:
+        finish(**main(width=args.width, height=args.height, headless=args.headless,
+                      preview_dir=args.preview, pyramid=args.pyramid))
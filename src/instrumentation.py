@@ -0,0 +1,172 @@
+import json
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+import numpy as np
+from src.optimized_encoding import EncodedImage
+
+# Set to a file path (metrics are appended as JSON lines) or to '1'/'-' (metrics go to stderr)
+ENV_VAR = 'DRAGONFRUIT_METRICS'
+
+# The run being recorded, or None when instrumentation is off
+_run = None
+
+def array_info(value):
+    """
+    Describe the size of a stage's input or output.
+
+    Parameters:
+    - value: A numpy array, an EncodedImage, a tuple or list of those, or anything else.
+
+    Returns:
+    - dict or list or None: 'shape', 'dtype' and 'nbytes' for an array, 'format', 'shape'
+      and 'nbytes' (summed over its arrays) for an EncodedImage, a list of descriptions for
+      a tuple or list, and None for anything else.
+    """
+    if isinstance(value, EncodedImage):
+        return {'format': value.format, 'shape': list(value.shape),
+                'nbytes': int(sum(array.nbytes for array in value.arrays.values()))}
+    if isinstance(value, np.ndarray):
+        return {'shape': list(value.shape), 'dtype': value.dtype.str, 'nbytes': int(value.nbytes)}
+    if isinstance(value, (tuple, list)):
+        return [array_info(item) for item in value]
+    return None
+
+class _Stage:
+    """
+    Measure one stage of a run: wall time, CPU time, memory allocated and the sizes of its
+    inputs and outputs.
+    """
+
+    def __init__(self, name, inputs):
+        self.record = {'stage': name, 'inputs': array_info(inputs) if inputs is not None else None,
+                       'outputs': None}
+
+    def output(self, value):
+        """
+        Record the size of the stage's result and return it unchanged.
+        """
+        self.record['outputs'] = array_info(value)
+        return value
+
+    def __enter__(self):
+        tracemalloc.reset_peak()
+        self.memory_start = tracemalloc.get_traced_memory()[0]
+        self.cpu_start = time.process_time()
+        self.wall_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.wall_start
+        cpu = time.process_time() - self.cpu_start
+        current, peak = tracemalloc.get_traced_memory()
+        self.record.update(wall_seconds=wall, cpu_seconds=cpu,
+                           allocated_bytes=current - self.memory_start,
+                           peak_bytes=peak - self.memory_start,
+                           error=repr(exc) if exc is not None else None)
+        _run['stages'].append(self.record)
+        _run['peak_traced_bytes'] = max(_run['peak_traced_bytes'], peak)
+        return False
+
+class _NullStage:
+    """
+    The stage handed out when instrumentation is off: every method does nothing.
+    """
+
+    def output(self, value):
+        return value
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+def enable(destination=None, **context):
+    """
+    Start recording a run. Metrics are only collected between `enable` and `finish`.
+
+    Parameters:
+    - destination (str, optional): A file the run's record is appended to as one JSON line,
+      or '-' for stderr. Defaults to None, meaning the value of the DRAGONFRUIT_METRICS
+      environment variable, or stderr if that is unset or '1'.
+    - **context: Extra fields stored in the record, such as the command-line parameters.
+    """
+    global _run
+    destination = destination or os.environ.get(ENV_VAR) or '-'
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    _run = {'run_id': uuid.uuid4().hex, 'timestamp': time.time(), 'argv': sys.argv,
+            'context': context, 'stages': [], 'destination': '-' if destination == '1' else destination,
+            'started_tracing': started_tracing, 'peak_traced_bytes': 0,
+            'wall_start': time.perf_counter(), 'cpu_start': time.process_time()}
+
+def enable_from_env(**context):
+    """
+    Call `enable` if the DRAGONFRUIT_METRICS environment variable is set.
+
+    Returns:
+    - bool: Whether instrumentation is on.
+    """
+    if os.environ.get(ENV_VAR):
+        enable(**context)
+    return is_enabled()
+
+def is_enabled():
+    """
+    Return True while a run is being recorded.
+    """
+    return _run is not None
+
+def stage(name, inputs=None):
+    """
+    Measure a stage of the current run.
+
+    Use as `with stage('encode', blob) as s: rle = s.output(encode(blob))`. When
+    instrumentation is off this returns a shared do-nothing object, so an instrumented
+    stage costs one function call and one global lookup.
+
+    Parameters:
+    - name (str): The stage name.
+    - inputs (optional): The stage's inputs, whose sizes are recorded, see `array_info`.
+
+    Returns:
+    - context manager: Its `output(value)` method records the size of the stage's result.
+    """
+    if _run is None:
+        return _NULL_STAGE
+    return _Stage(name, inputs)
+
+def finish(**results):
+    """
+    Stop recording and emit the run's metrics record as one JSON line.
+
+    Parameters:
+    - **results: Extra fields stored in the record, such as the verdicts.
+
+    Returns:
+    - dict or None: The record that was written, or None if instrumentation was off.
+    """
+    global _run
+    if _run is None:
+        return None
+    run, _run = _run, None
+    destination = run.pop('destination')
+    run['wall_seconds'] = time.perf_counter() - run.pop('wall_start')
+    run['cpu_seconds'] = time.process_time() - run.pop('cpu_start')
+    run['peak_traced_bytes'] = max(run['peak_traced_bytes'], tracemalloc.get_traced_memory()[1])
+    run['results'] = results
+    if run.pop('started_tracing'):
+        tracemalloc.stop()
+    line = json.dumps(run, default=lambda value: value.item() if isinstance(value, np.generic) else str(value))
+    if destination == '-':
+        print(line, file=sys.stderr)
+    else:
+        with open(destination, 'a') as f:
+            f.write(line + '\n')
+    return run
@@ -0,0 +1,226 @@
+import csv
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+import numpy as np
+from src.optimized_encoding import EncodedImage
+from src.optimized_decoding import decode_encoded_optimized
+from src.optimized_cancerDetection import cancer_verdicts, score_encoded
+from src.storage import load_encoded
+
+MICROSCOPE_FILE = 'microscope.bin'
+DYE_FILE = 'dye_sensor.bin'
+
+REPORT_FIELDS = ('id', 'blob_area', 'dye_in_blob', 'total_area', 'cancer_microscope', 'cancer_dye',
+                 'compute_ms', 'latency_ms', 'error')
+
+# Decode buffers kept by each worker process, keyed by image shape
+_worker_buffers = {}
+
+def find_samples(source):
+    """
+    List the microscope/dye pairs of a batch.
+
+    Parameters:
+    - source (str): Either a JSONL manifest whose records hold 'id', 'microscope' and 'dye'
+      paths (relative paths are resolved against the manifest's directory), or a directory
+      in which every subdirectory holding microscope.bin and dye_sensor.bin, as written by
+      `optimized_main.main`, is one sample.
+
+    Returns:
+    - list of tuple: `(sample_id, microscope_path, dye_path)` for every sample.
+    """
+    if os.path.isfile(source):
+        base = os.path.dirname(os.path.abspath(source))
+        samples = []
+        with open(source) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    samples.append((str(record['id']), os.path.join(base, record['microscope']),
+                                    os.path.join(base, record['dye'])))
+        return samples
+    samples = []
+    for root, _, files in sorted(os.walk(source)):
+        if MICROSCOPE_FILE in files and DYE_FILE in files:
+            samples.append((os.path.relpath(root, source), os.path.join(root, MICROSCOPE_FILE),
+                            os.path.join(root, DYE_FILE)))
+    return samples
+
+def _share_sample(microscope_path, dye_path):
+    """
+    Copy a sample's encoded arrays into one shared memory block.
+
+    Returns:
+    - tuple: `(block, layout)`, the SharedMemory block and a picklable description of the
+      images in it: for each of 'microscope' and 'dye', `(kind, shape, arrays)` where arrays
+      lists `(name, dtype, array_shape, offset)`.
+    """
+    images = {'microscope': load_encoded(microscope_path), 'dye': load_encoded(dye_path)}
+    total = sum(array.nbytes for _, _, arrays in images.values() for array in arrays.values())
+    block = shared_memory.SharedMemory(create=True, size=max(total, 1))
+    layout, offset = {}, 0
+    try:
+        for role, (kind, shape, arrays) in images.items():
+            entries = []
+            for name, array in arrays.items():
+                np.ndarray(array.shape, array.dtype, buffer=block.buf, offset=offset)[...] = array
+                entries.append((name, array.dtype.str, array.shape, offset))
+                offset += array.nbytes
+            layout[role] = (kind, shape, entries)
+    except BaseException:
+        # Reading a truncated file through its memory map can fail mid-copy; the block has
+        # no other owner yet, so remove it rather than leak it
+        block.close()
+        block.unlink()
+        raise
+    return block, layout
+
+def _attach(block, kind, shape, entries):
+    """
+    Rebuild an EncodedImage whose arrays are views of a shared memory block.
+    """
+    arrays = {name: np.ndarray(array_shape, np.dtype(dtype), buffer=block.buf, offset=offset)
+              for name, dtype, array_shape, offset in entries}
+    return EncodedImage(kind, tuple(shape), arrays)
+
+def _score_block(block, layout, decode):
+    """
+    Score the sample held in a shared memory block. The views of the block only live in
+    this frame, so the block can be closed as soon as it returns.
+    """
+    blob = _attach(block, *layout['microscope'])
+    dye = _attach(block, *layout['dye'])
+    shape = blob.shape
+    if not decode:
+        return score_encoded(dye, blob, shape)
+    if shape not in _worker_buffers:
+        _worker_buffers[shape] = (np.empty(shape, dtype=bool), np.empty(shape, dtype=bool))
+    blob_image, dye_image = _worker_buffers[shape]
+    decode_encoded_optimized(blob, out=blob_image)
+    decode_encoded_optimized(dye, out=dye_image)
+    blob_area = int(np.count_nonzero(blob_image))
+    np.logical_and(dye_image, blob_image, out=dye_image)
+    dye_in_blob = int(np.count_nonzero(dye_image))
+    return dict(blob_area=blob_area, dye_in_blob=dye_in_blob, total_area=blob_image.size,
+                **cancer_verdicts(blob_area, dye_in_blob, blob_image.size))
+
+def _score_shared(sample_id, block_name, layout, decode):
+    """
+    Score one sample in a worker process, reading its arrays from shared memory.
+    """
+    start = time.perf_counter()
+    block = shared_memory.SharedMemory(name=block_name)
+    error = None
+    try:
+        result = _score_block(block, layout, decode)
+    except Exception as exc:
+        # Keep only the message so the traceback does not pin views of the block
+        error = repr(exc)
+    block.close()
+    if error is not None:
+        raise RuntimeError(error)
+    result['id'] = sample_id
+    result['compute_ms'] = (time.perf_counter() - start) * 1e3
+    return result
+
+class _ReportWriter:
+    """
+    Append per-sample results to a JSONL or CSV report as they arrive.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='')
+        self.csv = None
+        if path.endswith('.csv'):
+            self.csv = csv.DictWriter(self.file, fieldnames=REPORT_FIELDS, extrasaction='ignore')
+            self.csv.writeheader()
+
+    def write(self, result):
+        if self.csv is not None:
+            self.csv.writerow(result)
+        else:
+            self.file.write(json.dumps(result) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def score_batch(source, report_path, workers=None, decode=False, max_in_flight=None):
+    """
+    Score many microscope/dye pairs on a process pool and stream the results to a report.
+
+    The parent process loads each pair from its binary container files into a shared memory
+    block and submits only the block's name and layout, so no array is pickled between
+    processes. Workers score the encoded images directly, or decode them into a reusable
+    per-process buffer when `decode` is True. At most `max_in_flight` samples are held in
+    shared memory at once; each block is released as soon as its result is written.
+
+    Parameters:
+    - source (str): A JSONL manifest or a directory of samples, see `find_samples`.
+    - report_path (str): The report to write, CSV if it ends in '.csv' and JSONL otherwise.
+      Each line holds the sample id, counts, verdicts, worker compute time and end-to-end
+      latency in milliseconds, or an error message.
+    - workers (int, optional): The number of worker processes. Defaults to None, meaning
+      `os.cpu_count()`.
+    - decode (bool, optional): If True, decode both images and use dense counts instead of
+      the encoded-domain detectors. Defaults to False.
+    - max_in_flight (int, optional): The largest number of samples submitted but not yet
+      reported. Defaults to twice the number of workers.
+
+    Returns:
+    - dict: 'samples', 'errors', 'seconds' and 'samples_per_second' for the whole batch.
+    """
+    samples = find_samples(source)
+    workers = workers or os.cpu_count()
+    max_in_flight = max_in_flight or 2 * workers
+    report = _ReportWriter(report_path)
+    pending = {}
+    errors = 0
+    start = time.perf_counter()
+
+    def collect(done):
+        nonlocal errors
+        for future in done:
+            block, sample_id, submitted = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as exc:
+                result = {'id': sample_id, 'error': repr(exc)}
+                errors += 1
+            result['latency_ms'] = (time.perf_counter() - submitted) * 1e3
+            report.write(result)
+            block.close()
+            block.unlink()
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for sample_id, microscope_path, dye_path in samples:
+                if len(pending) >= max_in_flight:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                submitted = time.perf_counter()
+                try:
+                    block, layout = _share_sample(microscope_path, dye_path)
+                except (OSError, ValueError) as exc:
+                    report.write({'id': sample_id, 'error': repr(exc), 'latency_ms': 0.0})
+                    errors += 1
+                    continue
+                future = executor.submit(_score_shared, sample_id, block.name, layout, decode)
+                pending[future] = (block, sample_id, submitted)
+            collect(wait(pending).done)
+    finally:
+        for block, _, _ in pending.values():
+            block.close()
+            block.unlink()
+        report.close()
+
+    seconds = time.perf_counter() - start
+    return {
+        'samples': len(samples),
+        'errors': errors,
+        'seconds': seconds,
+        'samples_per_second': len(samples) / seconds if seconds > 0 else 0.0,
+    }
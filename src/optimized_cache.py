@@ -0,0 +1,230 @@
+import hashlib
+import json
+import os
+import tempfile
+from collections import OrderedDict
+import numpy as np
+from src.optimized_encoding import EncodedImage
+from src.optimized_decoding import decode_encoded_optimized, decode_rle_optimized, decode_sparse_matrix_optimized
+from src.optimized_cancerDetection import blob_intervals, cancer_verdicts, count_dye_in_blob
+from src.storage import dumps, load_encoded
+
+DEFAULT_CACHE_BYTES = 256 * 2**20
+
+def _hash_array(digest, array):
+    array = np.ascontiguousarray(array)
+    digest.update(f'{array.dtype.str}{array.shape}'.encode('ascii'))
+    digest.update(memoryview(array).cast('B'))
+
+def payload_key(*payloads, **params):
+    """
+    Hash encoded images and the parameters applied to them into a cache key.
+
+    Parameters:
+    - *payloads (numpy.ndarray or EncodedImage): The encoded inputs. An EncodedImage is
+      hashed with its format, shape and every named array; a plain array with its dtype
+      and shape, so equal bytes in different layouts give different keys.
+    - **params: The parameters of the computation, such as the operation and image shape.
+
+    Returns:
+    - str: A hex digest identifying the payloads and parameters.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    for payload in payloads:
+        if isinstance(payload, EncodedImage):
+            digest.update(f'{payload.format}{tuple(payload.shape)}'.encode('ascii'))
+            for name in sorted(payload.arrays):
+                digest.update(name.encode('ascii'))
+                _hash_array(digest, payload.arrays[name])
+        else:
+            _hash_array(digest, np.asarray(payload))
+    digest.update(repr(sorted(params.items())).encode('ascii'))
+    return digest.hexdigest()
+
+def _nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return 256
+
+class ResultCache:
+    """
+    A content-addressed cache of decoded images and detection counts.
+
+    Entries live in an in-memory LRU bounded by `max_bytes`; the least recently used are
+    evicted first, and a value larger than the whole budget is never held in memory. With
+    `disk_dir`, every entry is also written to disk (arrays as binary containers that are
+    memory-mapped back, counts as JSON), and an entry missing from memory is looked up
+    there before counting as a miss. Files are written to a temporary name and renamed into
+    place, so a reader never sees a partial file and disk hits skip the checksum, which
+    would otherwise cost more than decoding most images again.
+
+    Parameters:
+    - max_bytes (int, optional): The memory budget. Defaults to DEFAULT_CACHE_BYTES (256 MiB).
+    - disk_dir (str, optional): The directory of the on-disk tier. Defaults to None, meaning
+      memory only.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES, disk_dir=None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.memory_hits = self.disk_hits = self.misses = 0
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _remember(self, key, value):
+        size = _nbytes(value)
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.bytes -= _nbytes(self.entries.pop(key))
+        self.entries[key] = value
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= _nbytes(evicted)
+
+    def _disk_path(self, key, value=None):
+        if value is None:
+            for suffix in ('.bin', '.json'):
+                if os.path.exists(os.path.join(self.disk_dir, key + suffix)):
+                    return os.path.join(self.disk_dir, key + suffix)
+            return None
+        return os.path.join(self.disk_dir, key + ('.bin' if isinstance(value, np.ndarray) else '.json'))
+
+    def get(self, key):
+        """
+        Return the value cached under `key`, or None on a miss.
+        """
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.memory_hits += 1
+            return self.entries[key]
+        path = self._disk_path(key) if self.disk_dir is not None else None
+        if path is not None:
+            try:
+                if path.endswith('.bin'):
+                    value = load_encoded(path, verify=False)[2]['image']
+                else:
+                    with open(path) as f:
+                        value = json.load(f)
+            except (OSError, ValueError):
+                # A truncated or corrupt file is a miss; it is overwritten by the next put
+                pass
+            else:
+                self.disk_hits += 1
+                self._remember(key, value)
+                return value
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        """
+        Cache a decoded image (numpy array) or a JSON-serializable dict of counts under
+        `key`.
+
+        An array is held as a read-only view, since every later hit returns the same object;
+        the caller's array stays writeable, and must not be written to once cached.
+
+        Returns:
+        - numpy.ndarray or dict: The cached value, the read-only view for an array.
+        """
+        if isinstance(value, np.ndarray):
+            value = value.view()
+            value.flags.writeable = False
+        self._remember(key, value)
+        if self.disk_dir is not None:
+            if isinstance(value, np.ndarray):
+                data = dumps('decoded', value.shape, {'image': value})
+            else:
+                data = json.dumps(value).encode()
+            # A unique temporary name keeps concurrent writers of one key from mixing files
+            with tempfile.NamedTemporaryFile(dir=self.disk_dir, suffix='.tmp', delete=False) as f:
+                f.write(data)
+            os.replace(f.name, self._disk_path(key, value))
+        return value
+
+    def stats(self):
+        """
+        Return the hit and miss counters and the memory use of the cache.
+
+        Returns:
+        - dict: 'hits' (memory plus disk), 'memory_hits', 'disk_hits', 'misses', 'entries'
+          and 'bytes' held in memory.
+        """
+        return {'hits': self.memory_hits + self.disk_hits, 'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits, 'misses': self.misses,
+                'entries': len(self.entries), 'bytes': self.bytes}
+
+def cached_decode(cache, encoded, shape=None, dtype=np.uint8):
+    """
+    Decode an encoded image through a cache.
+
+    Parameters:
+    - cache (ResultCache): The cache to use.
+    - encoded (numpy.ndarray or EncodedImage): A flat RLE array, an (n, 3) sparse matrix or
+      an EncodedImage in any format of `decode_encoded_optimized`.
+    - shape (tuple, optional): The (height, width) of the image; required for plain arrays.
+    - dtype (numpy.dtype, optional): The dtype of the decoded image. Defaults to np.uint8.
+
+    Returns:
+    - numpy.ndarray: The decoded image. It is shared with the cache and read-only.
+    """
+    shape = tuple(encoded.shape if shape is None else shape)
+    key = payload_key(encoded, operation='decode', shape=shape, dtype=np.dtype(dtype).str)
+    image = cache.get(key)
+    if image is None:
+        if isinstance(encoded, EncodedImage):
+            image = decode_encoded_optimized(encoded, shape, dtype=dtype)
+        elif np.ndim(encoded) == 1:
+            image = decode_rle_optimized(encoded, shape, dtype=dtype)
+        else:
+            image = decode_sparse_matrix_optimized(encoded, shape, dtype=dtype)
+        image = cache.put(key, image)
+    return image
+
+def cached_counts(cache, sparse_matrix, rle_encoded, shape):
+    """
+    Measure an encoded microscope/dye pair through a cache.
+
+    Parameters:
+    - cache (ResultCache): The cache to use.
+    - sparse_matrix (numpy.ndarray or EncodedImage): The dye distribution, in any form
+      accepted by `count_dye_in_blob`.
+    - rle_encoded (numpy.ndarray or EncodedImage): The microscope image, in any form
+      accepted by `blob_intervals`.
+    - shape (tuple): The (height, width) of both images.
+
+    Returns:
+    - dict: 'blob_area', 'dye_in_blob' and 'total_area', a copy the caller may modify.
+    """
+    key = payload_key(sparse_matrix, rle_encoded, operation='counts', shape=tuple(shape))
+    counts = cache.get(key)
+    if counts is None:
+        starts, ends = blob_intervals(rle_encoded)
+        counts = {'blob_area': int(np.sum(ends - starts)),
+                  'dye_in_blob': count_dye_in_blob(sparse_matrix, rle_encoded, shape),
+                  'total_area': shape[0] * shape[1]}
+        cache.put(key, counts)
+    return dict(counts)
+
+def cached_score(cache, sparse_matrix, rle_encoded, shape):
+    """
+    Score an encoded microscope/dye pair like `score_encoded`, through a cache.
+
+    Only the counts are cached; the verdicts are recomputed from them on every call with
+    the current thresholds, so changing a threshold never needs the cache to be cleared, and
+    a repeated score costs one hash of the payloads.
+
+    Parameters:
+    - cache (ResultCache): The cache to use.
+    - sparse_matrix (numpy.ndarray or EncodedImage): The dye distribution.
+    - rle_encoded (numpy.ndarray or EncodedImage): The microscope image.
+    - shape (tuple): The (height, width) of both images.
+
+    Returns:
+    - dict: 'blob_area', 'dye_in_blob', 'total_area' and the verdicts of `cancer_verdicts`.
+    """
+    counts = cached_counts(cache, sparse_matrix, rle_encoded, shape)
+    return dict(counts, **cancer_verdicts(counts['blob_area'], counts['dye_in_blob'], counts['total_area']))
@@ -1,4 +1,43 @@
+import os
+import threading
+from bisect import bisect_left
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+from src.optimized_decoding import _DECODE_CHUNK, rle_runs
+from src.optimized_encoding import EncodedImage, row_numbers, rows_to_flat_intervals
+from src.optimized_contour import contour_area, contour_contains, contour_to_rows
+
+# A blob covering more than this fraction of the image is considered potentially cancerous
+MICROSCOPE_AREA_THRESHOLD = 0.25
+# Dye covering more than this fraction of the blob's area is considered potentially cancerous
+DYE_CONCENTRATION_THRESHOLD = 0.1
+
+# Rows examined between two checks of the early-exit detectors
+SCREEN_CHUNK_ROWS = 128
+# Blob intervals examined between two checks of `screen_microscope_encoded`
+SCREEN_CHUNK_RUNS = 4096
+
+# Pixels per tile of the parallel dense detectors, small enough for a tile of each image
+# and its scratch buffer to stay in cache
+PARALLEL_TILE_PIXELS = 2**20
+
+# Per-thread scratch buffers of the parallel dense detectors
+_scratch = threading.local()
+
+class ScreenResult(namedtuple('ScreenResult', ['verdict', 'examined'])):
+    """
+    The result of an early-exit detector: the verdict, and the fraction of the input that
+    was examined before the verdict became certain. Its truth value is the verdict's, so it
+    can be tested like the bool of the detector it stands in for.
+    """
+    __slots__ = ()
+
+    def __bool__(self):
+        return bool(self.verdict)
+
+# Number of set bits in every possible byte value
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
 
 def has_cancer_microscope_optimized(blob):
     """
@@ -24,7 +63,7 @@ def has_cancer_microscope_optimized(blob):
     """
     blob_area = np.sum(blob)
     total_area = blob.size
-    return blob_area > 0.25 * total_area
+    return blob_area > MICROSCOPE_AREA_THRESHOLD * total_area
 
 def has_cancer_dye_optimized(dye_distribution, blob):
     """
@@ -54,4 +93,582 @@ def has_cancer_dye_optimized(dye_distribution, blob):
     """
     dye_concentration_inside_blob = np.sum(dye_distribution & blob)
     blob_area = np.sum(blob)
-    return dye_concentration_inside_blob > 0.1 * blob_area
+    return dye_concentration_inside_blob > DYE_CONCENTRATION_THRESHOLD * blob_area
+
+def blob_intervals_rle(rle_encoded):
+    """
+    Extract the blob's pixels from an RLE array as half-open intervals of the raveled image.
+
+    Parameters:
+    - rle_encoded (numpy.ndarray): The RLE encoded microscope image, alternating values and
+      run lengths as produced by `encode_rle_optimized`.
+
+    Returns:
+    - tuple of numpy.ndarray: `(starts, ends)`, sorted int64 offsets such that the blob
+      covers raveled pixels `starts[i] <= p < ends[i]`.
+    """
+    starts, lengths, values = rle_runs(rle_encoded)
+    blob_runs = (values != 0) & (lengths > 0)
+    return starts[blob_runs], starts[blob_runs] + lengths[blob_runs]
+
+def _in_intervals(positions, starts, ends):
+    """
+    Test which raveled pixel offsets fall inside a sorted list of disjoint intervals.
+
+    Parameters:
+    - positions (numpy.ndarray): Offsets into the raveled image.
+    - starts (numpy.ndarray): Sorted interval start offsets.
+    - ends (numpy.ndarray): Exclusive interval end offsets, matching `starts`.
+
+    Returns:
+    - numpy.ndarray: A boolean array, True where `positions` lies inside an interval.
+    """
+    if starts.size == 0:
+        return np.zeros(np.shape(positions), dtype=bool)
+    run = np.searchsorted(starts, positions, side='right') - 1
+    return (run >= 0) & (positions < ends[np.maximum(run, 0)])
+
+def blob_intervals(blob_encoded):
+    """
+    Extract the blob's pixels from any blob encoding as half-open intervals of the raveled
+    image.
+
+    Parameters:
+    - blob_encoded (numpy.ndarray or EncodedImage): A flat RLE array, or an EncodedImage in
+      the 'rle', 'rle_rows' or 'contour' format.
+
+    Returns:
+    - tuple of numpy.ndarray: `(starts, ends)`, sorted int64 offsets such that the blob
+      covers raveled pixels `starts[i] <= p < ends[i]`.
+    """
+    if not isinstance(blob_encoded, EncodedImage):
+        return blob_intervals_rle(blob_encoded)
+    if blob_encoded.format == 'rle':
+        return blob_intervals_rle(blob_encoded.arrays['rle'])
+    if blob_encoded.format == 'rle_rows':
+        return rows_to_flat_intervals(blob_encoded)
+    if blob_encoded.format == 'contour':
+        return rows_to_flat_intervals(contour_to_rows(blob_encoded))
+    raise ValueError(f"Unsupported blob encoding format {blob_encoded.format!r}")
+
+def blob_area_encoded(blob_encoded):
+    """
+    Measure the area of an encoded blob.
+
+    Parameters:
+    - blob_encoded (numpy.ndarray or EncodedImage): The blob, in any form accepted by
+      `blob_intervals`.
+
+    Returns:
+    - int: The number of blob pixels. A contour is measured from its outline with
+      `contour_area`; other encodings by summing their intervals.
+    """
+    if isinstance(blob_encoded, EncodedImage) and blob_encoded.format == 'contour':
+        return contour_area(blob_encoded)
+    starts, ends = blob_intervals(blob_encoded)
+    return int(np.sum(ends - starts))
+
+def _interval_prefix(starts, ends, positions):
+    """
+    Count the pixels covered by sorted disjoint intervals that lie before each position.
+
+    Parameters:
+    - starts (numpy.ndarray): Sorted interval start offsets.
+    - ends (numpy.ndarray): Exclusive interval end offsets, matching `starts`.
+    - positions (numpy.ndarray): Offsets into the raveled image.
+
+    Returns:
+    - numpy.ndarray: For each position p, the number of covered pixels q with q < p.
+    """
+    if starts.size == 0:
+        return np.zeros(np.shape(positions), dtype=np.int64)
+    covered_before = np.concatenate(([0], np.cumsum(ends - starts)))
+    run = np.searchsorted(starts, positions, side='right') - 1
+    clipped = np.maximum(run, 0)
+    partial = np.clip(positions - starts[clipped], 0, ends[clipped] - starts[clipped])
+    return np.where(run >= 0, covered_before[clipped] + partial, 0)
+
+def _packed_count(bits, starts, ends):
+    """
+    Count the set bits of a `np.packbits` array that lie inside the given intervals.
+
+    The bits are walked in slices of _DECODE_CHUNK bytes. Each slice that some interval
+    overlaps is popcounted once into a slice-sized prefix sum, and the intervals, clipped to
+    the slice, are counted from it, with the partial bytes at their edges masked by a shift.
+    Memory stays bounded by the slice size whatever the size of the image.
+
+    Parameters:
+    - bits (numpy.ndarray): The packed bits, most significant bit first.
+    - starts (numpy.ndarray): Sorted interval start offsets, in bits.
+    - ends (numpy.ndarray): Exclusive interval end offsets, matching `starts`, at most
+      8 * len(bits).
+
+    Returns:
+    - int: The number of set bits inside the intervals.
+    """
+    total = 0
+    # Set bits before each byte of the current slice, reused by every slice
+    prefix = np.zeros(min(bits.size, _DECODE_CHUNK) + 1, dtype=np.int32)
+    for first in range(0, bits.size, _DECODE_CHUNK):
+        chunk = bits[first:first + _DECODE_CHUNK]
+        bit_first, bit_last = 8 * first, 8 * (first + chunk.size)
+        lo = int(np.searchsorted(ends, bit_first, side='right'))
+        hi = int(np.searchsorted(starts, bit_last, side='left'))
+        if lo == hi:
+            continue
+        set_before = prefix[:chunk.size + 1]
+        # Accumulate in place: a cumsum of the uint8 popcounts into an int32 output would
+        # go through an int64 temporary
+        set_before[1:] = _POPCOUNT[chunk]
+        np.cumsum(set_before, dtype=np.int32, out=set_before)
+        counts = []
+        for positions in (ends[lo:hi], starts[lo:hi]):
+            positions = np.clip(positions, bit_first, bit_last) - bit_first
+            byte, bit = positions >> 3, positions & 7
+            # A position at the end of the slice has bit 0, which shifts its byte out entirely
+            partial = chunk[np.minimum(byte, chunk.size - 1)].astype(np.int64) >> (8 - bit)
+            counts.append(set_before[byte] + _POPCOUNT[partial])
+        total += int(np.sum(counts[0] - counts[1]))
+    return total
+
+def _count_encoded_in_intervals(encoded, starts, ends, shape):
+    """
+    Count the dyed pixels of an EncodedImage that fall inside the given intervals.
+
+    Parameters:
+    - encoded (EncodedImage): A dye distribution in the 'packed', 'coo', 'csr' or 'rle' format.
+    - starts (numpy.ndarray): Sorted interval start offsets into the raveled image.
+    - ends (numpy.ndarray): Exclusive interval end offsets, matching `starts`.
+    - shape (tuple): The (height, width) of the image.
+
+    Returns:
+    - int: The number of dyed pixels inside the intervals.
+    """
+    arrays = encoded.arrays
+    if encoded.format == 'coo':
+        positions = arrays['rows'].astype(np.int64) * shape[1] + arrays['cols']
+        return int(np.count_nonzero(_in_intervals(positions, starts, ends)))
+    if encoded.format == 'csr':
+        positions = row_numbers(arrays['indptr']) * shape[1] + arrays['indices']
+        return int(np.count_nonzero(_in_intervals(positions, starts, ends)))
+    if encoded.format == 'packed':
+        return _packed_count(arrays['bits'], starts, ends)
+    if encoded.format == 'rle':
+        dye_starts, dye_ends = blob_intervals_rle(arrays['rle'])
+        return int(np.sum(_interval_prefix(dye_starts, dye_ends, ends)
+                          - _interval_prefix(dye_starts, dye_ends, starts)))
+    raise ValueError(f"Unknown encoding format {encoded.format!r}")
+
+def _dye_pixels(sparse_matrix, shape):
+    """
+    Return the `(rows, cols)` of the dyed pixels of a point encoding ('sparse', 'coo' or
+    'csr', or an (n, 3) sparse matrix), or None for the 'packed' and 'rle' formats.
+    """
+    if isinstance(sparse_matrix, EncodedImage):
+        arrays = sparse_matrix.arrays
+        if sparse_matrix.format == 'coo':
+            return arrays['rows'], arrays['cols']
+        if sparse_matrix.format == 'csr':
+            return row_numbers(arrays['indptr']), arrays['indices']
+        if sparse_matrix.format != 'sparse':
+            return None
+        sparse_matrix = arrays['sparse']
+    rows, cols, values = np.asarray(sparse_matrix).reshape(-1, 3).T
+    return rows[values != 0], cols[values != 0]
+
+def count_dye_in_blob(sparse_matrix, rle_encoded, shape):
+    """
+    Count the dyed pixels that fall inside the blob without decoding either image.
+
+    Each sparse `(row, col)` coordinate is turned into an offset into the raveled image and
+    looked up among the blob's run intervals with a binary search, so the cost grows with
+    the number of dyed pixels and blob runs rather than with the image area. A contour blob
+    is tested pixel by pixel against its outline with `contour_contains` instead, unless the
+    dye is 'packed' or 'rle'.
+
+    Parameters:
+    - sparse_matrix (numpy.ndarray or EncodedImage): An (n, 3) array of (row, column, value)
+      entries as produced by `encode_sparse_matrix_optimized`, or a dye distribution encoded
+      by `encode_dye_optimized` in any of its formats.
+    - rle_encoded (numpy.ndarray or EncodedImage): The RLE encoded microscope image, flat or
+      as an 'rle', 'rle_rows' or 'contour' EncodedImage.
+    - shape (tuple): The (height, width) of both images.
+
+    Returns:
+    - int: The number of dyed pixels inside the blob.
+    """
+    if isinstance(rle_encoded, EncodedImage) and rle_encoded.format == 'contour':
+        dye_pixels = _dye_pixels(sparse_matrix, shape)
+        if dye_pixels is not None:
+            return int(np.count_nonzero(contour_contains(rle_encoded, *dye_pixels)))
+    starts, ends = blob_intervals(rle_encoded)
+    if isinstance(sparse_matrix, EncodedImage):
+        if sparse_matrix.format != 'sparse':
+            return _count_encoded_in_intervals(sparse_matrix, starts, ends, shape)
+        sparse_matrix = sparse_matrix.arrays['sparse']
+    rows, cols, values = np.asarray(sparse_matrix).reshape(-1, 3).T
+    positions = rows.astype(np.int64) * shape[1] + cols
+    return int(np.count_nonzero(_in_intervals(positions, starts, ends) & (values != 0)))
+
+def has_cancer_microscope_encoded(rle_encoded, shape):
+    """
+    Determine if the blob is likely to be cancerous directly from its RLE encoding.
+
+    The blob area is the sum of the lengths of the runs whose value is 1, so the test
+    never materializes the image and its cost scales with the number of runs. A contour is
+    measured from its outline with `contour_area`.
+
+    Parameters:
+    - rle_encoded (numpy.ndarray or EncodedImage): The RLE encoded microscope image, flat or
+      as an 'rle', 'rle_rows' or 'contour' EncodedImage.
+    - shape (tuple): The (height, width) of the image.
+
+    Returns:
+    - bool: True if the area of the blob is greater than 25% of the total area, matching
+            `has_cancer_microscope_optimized` on the decoded image. Otherwise, False.
+    """
+    blob_area = blob_area_encoded(rle_encoded)
+    total_area = shape[0] * shape[1]
+    return blob_area > MICROSCOPE_AREA_THRESHOLD * total_area
+
+def has_cancer_dye_encoded(sparse_matrix, rle_encoded, shape):
+    """
+    Determine if the blob is likely to be cancerous from the encoded dye and microscope
+    images, without decoding either of them.
+
+    Parameters:
+    - sparse_matrix (numpy.ndarray or EncodedImage): An (n, 3) array of (row, column, value)
+      entries for the dyed pixels, or the output of `encode_dye_optimized`.
+    - rle_encoded (numpy.ndarray or EncodedImage): The RLE encoded microscope image, flat or
+      as an 'rle', 'rle_rows' or 'contour' EncodedImage.
+    - shape (tuple): The (height, width) of both images.
+
+    Returns:
+    - bool: True if the number of dyed pixels inside the blob is greater than 10% of the
+            blob's area, matching `has_cancer_dye_optimized` on the decoded images.
+            Otherwise, False.
+    """
+    blob_area = blob_area_encoded(rle_encoded)
+    dye_concentration_inside_blob = count_dye_in_blob(sparse_matrix, rle_encoded, shape)
+    return dye_concentration_inside_blob > DYE_CONCENTRATION_THRESHOLD * blob_area
+
+def cancer_verdicts(blob_area, dye_in_blob, total_area):
+    """
+    Turn blob and dye counts into the microscope and dye verdicts of the pipeline.
+
+    Parameters:
+    - blob_area (int): The number of blob pixels.
+    - dye_in_blob (int): The number of dyed pixels inside the blob.
+    - total_area (int): The number of pixels in the image.
+
+    Returns:
+    - dict: 'cancer_microscope', True if the blob covers more than 25% of the image, and
+      'cancer_dye', True if that holds and the dye inside the blob exceeds 10% of its area.
+      As in `main.py`, the dye verdict is False whenever the microscope verdict is False.
+    """
+    cancer_microscope = blob_area > MICROSCOPE_AREA_THRESHOLD * total_area
+    return {
+        'cancer_microscope': bool(cancer_microscope),
+        'cancer_dye': bool(cancer_microscope and dye_in_blob > DYE_CONCENTRATION_THRESHOLD * blob_area),
+    }
+
+def score_encoded(sparse_matrix, rle_encoded, shape):
+    """
+    Measure and score an encoded microscope/dye pair in one call, without decoding.
+
+    Parameters:
+    - sparse_matrix (numpy.ndarray or EncodedImage): The dye distribution, in any form
+      accepted by `count_dye_in_blob`.
+    - rle_encoded (numpy.ndarray or EncodedImage): The microscope image, in any form
+      accepted by `blob_intervals`.
+    - shape (tuple): The (height, width) of both images.
+
+    Returns:
+    - dict: 'blob_area', 'dye_in_blob', 'total_area' and the verdicts of `cancer_verdicts`.
+    """
+    blob_area = blob_area_encoded(rle_encoded)
+    dye_in_blob = count_dye_in_blob(sparse_matrix, rle_encoded, shape)
+    total_area = shape[0] * shape[1]
+    return dict(blob_area=blob_area, dye_in_blob=dye_in_blob, total_area=total_area,
+                **cancer_verdicts(blob_area, dye_in_blob, total_area))
+
+def _decided(count, remaining, target):
+    """
+    Return the verdict of `count + (up to remaining) > target` once it no longer depends on
+    the remaining part of the input, or None while it still does.
+    """
+    if count > target:
+        return True
+    if count + remaining <= target:
+        return False
+    return None
+
+def screen_microscope(blob, chunk_rows=SCREEN_CHUNK_ROWS):
+    """
+    Apply the microscope test of `has_cancer_microscope_optimized` band by band, stopping
+    as soon as the verdict is certain.
+
+    After each band of rows the blob area seen so far is compared with the threshold: the
+    test passes once the area exceeds it, and fails once even a fully covered remainder of
+    the image could not make it exceed it.
+
+    Parameters:
+    - blob (numpy.ndarray): A binary 2D numpy array holding the blob.
+    - chunk_rows (int, optional): The rows counted between two checks. Defaults to
+      SCREEN_CHUNK_ROWS.
+
+    Returns:
+    - ScreenResult: The verdict, equal to `has_cancer_microscope_optimized(blob)`, and the
+      fraction of the image's rows that were read.
+    """
+    height = blob.shape[0]
+    row_pixels = blob.size // height if height else 0
+    target = MICROSCOPE_AREA_THRESHOLD * blob.size
+    blob_area = 0
+    for row_start in range(0, height, chunk_rows):
+        row_stop = min(row_start + chunk_rows, height)
+        blob_area += int(np.count_nonzero(blob[row_start:row_stop]))
+        verdict = _decided(blob_area, (height - row_stop) * row_pixels, target)
+        if verdict is not None:
+            return ScreenResult(verdict, row_stop / height)
+    return ScreenResult(blob_area > target, 1.0)
+
+def screen_dye(dye_distribution, blob, chunk_rows=SCREEN_CHUNK_ROWS, blob_area=None):
+    """
+    Apply the dye test of `has_cancer_dye_optimized` band by band, stopping as soon as the
+    verdict is certain.
+
+    The threshold depends on the whole blob's area, which is counted first unless it is
+    given (counting the blob alone is much cheaper than intersecting it with the dye). After
+    each band the dye inside the blob so far is compared with the threshold: the test passes
+    once it exceeds it, and fails once dyeing every blob pixel not yet examined could not
+    make it exceed it.
+
+    Parameters:
+    - dye_distribution (numpy.ndarray): A binary 2D numpy array of the dyed pixels.
+    - blob (numpy.ndarray): A binary 2D numpy array holding the blob.
+    - chunk_rows (int, optional): The rows examined between two checks. Defaults to
+      SCREEN_CHUNK_ROWS.
+    - blob_area (int, optional): The number of blob pixels, if already known. Defaults to
+      None, meaning it is counted.
+
+    Returns:
+    - ScreenResult: The verdict, equal to `has_cancer_dye_optimized(dye_distribution, blob)`,
+      and the fraction of the image's rows whose dye was examined.
+    """
+    if blob_area is None:
+        blob_area = int(np.count_nonzero(blob))
+    height = blob.shape[0]
+    target = DYE_CONCENTRATION_THRESHOLD * blob_area
+    dye_in_blob = blob_seen = 0
+    for row_start in range(0, height, chunk_rows):
+        row_stop = min(row_start + chunk_rows, height)
+        blob_band = blob[row_start:row_stop]
+        dye_in_blob += int(np.count_nonzero(dye_distribution[row_start:row_stop] & blob_band))
+        blob_seen += int(np.count_nonzero(blob_band))
+        verdict = _decided(dye_in_blob, blob_area - blob_seen, target)
+        if verdict is not None:
+            return ScreenResult(verdict, row_stop / height)
+    return ScreenResult(dye_in_blob > target, 1.0)
+
+def screen_microscope_encoded(rle_encoded, shape, chunk_runs=SCREEN_CHUNK_RUNS):
+    """
+    Apply the microscope test of `has_cancer_microscope_encoded` a chunk of blob intervals
+    at a time, stopping as soon as the verdict is certain. Everything after the end of the
+    last interval examined is counted as potentially blob.
+
+    Parameters:
+    - rle_encoded (numpy.ndarray or EncodedImage): The RLE encoded microscope image, in any
+      form accepted by `blob_intervals`.
+    - shape (tuple): The (height, width) of the image.
+    - chunk_runs (int, optional): The intervals summed between two checks. Defaults to
+      SCREEN_CHUNK_RUNS.
+
+    Returns:
+    - ScreenResult: The verdict, equal to `has_cancer_microscope_encoded`, and the fraction
+      of the blob's intervals that were summed.
+    """
+    starts, ends = blob_intervals(rle_encoded)
+    total_area = shape[0] * shape[1]
+    target = MICROSCOPE_AREA_THRESHOLD * total_area
+    blob_area = 0
+    for first in range(0, starts.size, chunk_runs):
+        last = min(first + chunk_runs, starts.size)
+        blob_area += int(np.sum(ends[first:last] - starts[first:last]))
+        verdict = _decided(blob_area, total_area - int(ends[last - 1]), target)
+        if verdict is not None:
+            return ScreenResult(verdict, last / starts.size)
+    return ScreenResult(blob_area > target, 1.0)
+
+def _dye_band_in_intervals(encoded, shape, row_start, row_stop, starts, ends, dye_intervals=None):
+    """
+    Count the dyed pixels of rows `row_start <= r < row_stop` that fall inside the given
+    intervals, reading only the part of the encoding that holds those rows.
+
+    Parameters:
+    - encoded (EncodedImage): A dye distribution in the 'sparse', 'coo', 'csr', 'packed' or
+      'rle' format. Entries of the 'sparse' and 'coo' formats must be in row-major order, as
+      the encoders produce them.
+    - shape (tuple): The (height, width) of the image.
+    - row_start (int): The first row of the band.
+    - row_stop (int): The row after the last row of the band.
+    - starts (numpy.ndarray): Sorted interval start offsets into the raveled image, already
+      clipped to the band.
+    - ends (numpy.ndarray): Exclusive interval end offsets, matching `starts`.
+    - dye_intervals (tuple, optional): The `(starts, ends)` of `blob_intervals_rle` for an
+      'rle' dye, computed once by the caller for all bands. Defaults to None, meaning they
+      are computed here, which reads the whole encoding.
+
+    Returns:
+    - int: The number of dyed pixels of the band inside the intervals.
+    """
+    width = shape[1]
+    arrays = encoded.arrays
+    if encoded.format == 'packed':
+        first_byte = row_start * width // 8
+        bits = arrays['bits'][first_byte:-(-row_stop * width // 8)]
+        return _packed_count(bits, starts - 8 * first_byte, ends - 8 * first_byte)
+    if encoded.format == 'rle':
+        dye_starts, dye_ends = dye_intervals if dye_intervals is not None else blob_intervals_rle(arrays['rle'])
+        first, last = row_start * width, row_stop * width
+        lo = int(np.searchsorted(dye_ends, first, side='right'))
+        hi = int(np.searchsorted(dye_starts, last, side='left'))
+        dye_starts = np.clip(dye_starts[lo:hi], first, last)
+        dye_ends = np.clip(dye_ends[lo:hi], first, last)
+        return int(np.sum(_interval_prefix(dye_starts, dye_ends, ends)
+                          - _interval_prefix(dye_starts, dye_ends, starts)))
+    if encoded.format == 'csr':
+        indptr = arrays['indptr']
+        lo, hi = int(indptr[row_start]), int(indptr[row_stop])
+        rows = row_numbers(indptr[row_start:row_stop + 1], row_start)
+        cols = arrays['indices'][lo:hi]
+    elif encoded.format == 'coo':
+        lo, hi = np.searchsorted(arrays['rows'], [row_start, row_stop])
+        rows, cols = arrays['rows'][lo:hi].astype(np.int64), arrays['cols'][lo:hi]
+    elif encoded.format == 'sparse':
+        sparse = arrays['sparse']
+        # Binary search the strided row column in place instead of copying it
+        lo, hi = bisect_left(sparse[:, 0], row_start), bisect_left(sparse[:, 0], row_stop)
+        rows, cols, values = sparse[lo:hi].T
+        rows, cols = rows[values != 0].astype(np.int64), cols[values != 0]
+    else:
+        raise ValueError(f"Unknown encoding format {encoded.format!r}")
+    return int(np.count_nonzero(_in_intervals(rows * width + cols, starts, ends)))
+
+def screen_dye_encoded(sparse_matrix, rle_encoded, shape, chunk_rows=SCREEN_CHUNK_ROWS):
+    """
+    Apply the dye test of `has_cancer_dye_encoded` band by band, stopping as soon as the
+    verdict is certain.
+
+    The blob's intervals give its area, and so the threshold, at the cost of one pass over
+    the blob runs. The dye encoding is then read one band of rows at a time: the test passes
+    once the dye inside the blob exceeds the threshold, and fails once dyeing every blob
+    pixel below the band could not make it exceed it. Each band only touches the entries
+    of the dye encoding that lie in its rows; an 'rle' dye, whose runs do not index rows,
+    is turned into intervals once and each band binary searches its own.
+
+    Parameters:
+    - sparse_matrix (numpy.ndarray or EncodedImage): The dye distribution, as an (n, 3)
+      sparse matrix in row-major order or in any format of `encode_dye_optimized`.
+    - rle_encoded (numpy.ndarray or EncodedImage): The microscope image, in any form
+      accepted by `blob_intervals`.
+    - shape (tuple): The (height, width) of both images.
+    - chunk_rows (int, optional): The rows examined between two checks. Defaults to
+      SCREEN_CHUNK_ROWS.
+
+    Returns:
+    - ScreenResult: The verdict, equal to `has_cancer_dye_encoded`, and the fraction of the
+      image's rows whose dye was examined.
+    """
+    if not isinstance(sparse_matrix, EncodedImage):
+        sparse_matrix = EncodedImage('sparse', tuple(shape), {'sparse': np.asarray(sparse_matrix).reshape(-1, 3)})
+    height, width = shape
+    starts, ends = blob_intervals(rle_encoded)
+    blob_area = int(np.sum(ends - starts))
+    target = DYE_CONCENTRATION_THRESHOLD * blob_area
+    dye_intervals = blob_intervals_rle(sparse_matrix.arrays['rle']) if sparse_matrix.format == 'rle' else None
+    dye_in_blob = blob_seen = 0
+    for row_start in range(0, height, chunk_rows):
+        row_stop = min(row_start + chunk_rows, height)
+        first, last = row_start * width, row_stop * width
+        lo = int(np.searchsorted(ends, first, side='right'))
+        hi = int(np.searchsorted(starts, last, side='left'))
+        band_starts = np.clip(starts[lo:hi], first, last)
+        band_ends = np.clip(ends[lo:hi], first, last)
+        dye_in_blob += _dye_band_in_intervals(sparse_matrix, shape, row_start, row_stop, band_starts, band_ends,
+                                              dye_intervals)
+        blob_seen += int(np.sum(band_ends - band_starts))
+        verdict = _decided(dye_in_blob, blob_area - blob_seen, target)
+        if verdict is not None:
+            return ScreenResult(verdict, row_stop / height)
+    return ScreenResult(dye_in_blob > target, 1.0)
+
+def _tile_counts(dye_distribution, blob, row_start, row_stop):
+    """
+    Count the blob pixels and the dyed blob pixels of rows `row_start <= r < row_stop`,
+    ANDing the tiles into this thread's scratch buffer instead of a new temporary.
+    """
+    blob_tile = blob[row_start:row_stop]
+    size = blob_tile.size
+    if getattr(_scratch, 'buffer', None) is None or _scratch.buffer.size < size:
+        _scratch.buffer = np.empty(size, dtype=bool)
+    both = _scratch.buffer[:size].reshape(blob_tile.shape)
+    np.logical_and(dye_distribution[row_start:row_stop], blob_tile, out=both)
+    return int(np.count_nonzero(blob_tile)), int(np.count_nonzero(both))
+
+def count_dye_in_blob_parallel(dye_distribution, blob, workers=None, tile_pixels=PARALLEL_TILE_PIXELS):
+    """
+    Count the blob area and the dyed pixels inside the blob of two dense images on a thread
+    pool.
+
+    The images are cut into bands of whole rows holding about `tile_pixels` pixels. Each
+    worker ANDs its bands into a reusable per-thread buffer and counts them, and the partial
+    counts are summed at the end, so no full-size temporary is allocated. NumPy releases the
+    GIL inside `logical_and` and `count_nonzero`, so the bands are counted on several cores
+    at once.
+
+    Parameters:
+    - dye_distribution (numpy.ndarray): A binary 2D numpy array of the dyed pixels.
+    - blob (numpy.ndarray): A binary 2D numpy array of the same shape holding the blob.
+    - workers (int, optional): The number of threads. Defaults to None, meaning
+      `os.cpu_count()`. With 1 the bands are counted in the calling thread.
+    - tile_pixels (int, optional): The approximate number of pixels per band. Defaults to
+      PARALLEL_TILE_PIXELS.
+
+    Returns:
+    - tuple of int: `(blob_area, dye_in_blob)`.
+    """
+    if dye_distribution.shape != blob.shape:
+        raise ValueError(f"image shapes differ: {dye_distribution.shape} and {blob.shape}")
+    height = blob.shape[0]
+    tile_rows = max(1, tile_pixels // max(blob.shape[1], 1))
+    bands = [(row_start, min(row_start + tile_rows, height)) for row_start in range(0, height, tile_rows)]
+    workers = min(workers or os.cpu_count(), max(len(bands), 1))
+    if workers <= 1:
+        counts = [_tile_counts(dye_distribution, blob, *band) for band in bands]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            counts = list(executor.map(lambda band: _tile_counts(dye_distribution, blob, *band), bands))
+    blob_area = sum(count[0] for count in counts)
+    dye_in_blob = sum(count[1] for count in counts)
+    return blob_area, dye_in_blob
+
+def has_cancer_dye_parallel(dye_distribution, blob, workers=None, tile_pixels=PARALLEL_TILE_PIXELS):
+    """
+    Apply the dye test of `has_cancer_dye_optimized` with the tiled, multi-threaded counts
+    of `count_dye_in_blob_parallel`.
+
+    Parameters:
+    - dye_distribution (numpy.ndarray): A binary 2D numpy array of the dyed pixels.
+    - blob (numpy.ndarray): A binary 2D numpy array of the same shape holding the blob.
+    - workers (int, optional): The number of threads. Defaults to None, meaning
+      `os.cpu_count()`.
+    - tile_pixels (int, optional): The approximate number of pixels per band. Defaults to
+      PARALLEL_TILE_PIXELS.
+
+    Returns:
+    - bool: True if the number of dyed pixels inside the blob is greater than 10% of the
+            blob's area. Otherwise, False.
+    """
+    blob_area, dye_in_blob = count_dye_in_blob_parallel(dye_distribution, blob, workers, tile_pixels)
+    return dye_in_blob > DYE_CONCENTRATION_THRESHOLD * blob_area
@@ -0,0 +1,225 @@
+import numpy as np
+from src.optimized_encoding import (EncodedImage, _run_boundaries, encode_rle_rows_optimized, encode_row_intervals,
+                                    rle_to_rows, rows_to_rle)
+
+def _delta_runs(edge):
+    """
+    Chain-code one edge of the outline: run-length encode its row-to-row column steps.
+
+    Parameters:
+    - edge (numpy.ndarray): The column of the edge on each row of the outline, in order.
+
+    Returns:
+    - numpy.ndarray: An (n, 2) array of (step, count) pairs, meaning the edge moves by
+      `step` columns on each of the next `count` rows, in the smallest signed integer dtype
+      that holds them.
+    """
+    steps, counts = _run_boundaries(np.diff(edge))
+    runs = np.column_stack((steps, counts)).reshape(-1, 2)
+    low, high = (int(runs.min()), int(runs.max())) if runs.size else (0, 0)
+    for dtype in (np.int8, np.int16, np.int32):
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return runs.astype(dtype)
+    return runs.astype(np.int64)
+
+def _expand_edge(first, runs, rows):
+    """
+    Expand the chain code of an edge into its column on every row.
+
+    Parameters:
+    - first (int): The column of the edge on the first row of the outline.
+    - runs (numpy.ndarray): The (n, 2) (step, count) pairs of `_delta_runs`.
+    - rows (int): The number of rows of the outline.
+
+    Returns:
+    - numpy.ndarray: The int64 column of the edge on each of the `rows` rows.
+    """
+    steps = np.repeat(runs[:, 0].astype(np.int64), runs[:, 1])
+    return first + np.concatenate(([0], np.cumsum(steps)))[:rows]
+
+def _edge_at(first, runs, offsets):
+    """
+    Evaluate an edge at row offsets from the first row of the outline, in O(log n) per
+    offset without expanding the runs.
+
+    Parameters:
+    - first (int): The column of the edge on the first row of the outline.
+    - runs (numpy.ndarray): The (n, 2) (step, count) pairs of `_delta_runs`.
+    - offsets (numpy.ndarray): Row offsets from the first row, each in [0, rows).
+
+    Returns:
+    - numpy.ndarray: The int64 column of the edge at each offset.
+    """
+    if runs.shape[0] == 0:
+        return np.full(np.shape(offsets), first, dtype=np.int64)
+    steps, counts = runs[:, 0].astype(np.int64), runs[:, 1].astype(np.int64)
+    run_end = np.cumsum(counts)
+    run_start = run_end - counts
+    base = first + np.concatenate(([0], np.cumsum(steps * counts)[:-1]))
+    run = np.minimum(np.searchsorted(run_end, offsets, side='left'), runs.shape[0] - 1)
+    return base[run] + steps[run] * (offsets - run_start[run])
+
+def rows_to_contour(rows_encoded):
+    """
+    Convert a row-indexed RLE ('rle_rows') blob into the contour format.
+
+    The contour format describes a row-convex blob (one interval on each of a range of
+    consecutive rows, such as the circles of `generate_blob`) by its outline: the first row
+    and its interval, then the left and right edges as chain codes, each the run-length
+    encoded sequence of column steps from one row to the next. Straight stretches of the
+    outline take one (step, count) pair whatever their length, so the encoding grows with
+    the number of corners of the outline, at most with its perimeter, never with its area.
+
+    Parameters:
+    - rows_encoded (EncodedImage): A blob in the 'rle_rows' format.
+
+    Returns:
+    - EncodedImage: The blob in the 'contour' format, with arrays 'origin' (int64 first row,
+      number of rows, first column and column after the last of the first row), 'left' and
+      'right' ((n, 2) step and count pairs).
+
+    Raises:
+    - ValueError: If the blob has a row with several intervals, or gaps between its rows.
+    """
+    row_ptr = rows_encoded.arrays['row_ptr'].astype(np.int64)
+    per_row = np.diff(row_ptr)
+    occupied = np.flatnonzero(per_row)
+    if np.any(per_row > 1) or (occupied.size and occupied[-1] - occupied[0] + 1 != occupied.size):
+        raise ValueError("the contour format needs a row-convex blob: one interval on each of consecutive rows")
+    left = rows_encoded.arrays['starts'].astype(np.int64)
+    right = rows_encoded.arrays['ends'].astype(np.int64)
+    if occupied.size == 0:
+        origin = np.zeros(4, dtype=np.int64)
+    else:
+        origin = np.array([occupied[0], occupied.size, left[0], right[0]], dtype=np.int64)
+    return EncodedImage('contour', tuple(rows_encoded.shape),
+                        {'origin': origin, 'left': _delta_runs(left), 'right': _delta_runs(right)})
+
+def rle_to_contour(rle_encoded, shape):
+    """
+    Convert a flat RLE array from `encode_rle_optimized` into the contour format, see
+    `rows_to_contour`.
+
+    Parameters:
+    - rle_encoded (numpy.ndarray): The RLE encoded blob.
+    - shape (tuple): The (height, width) of the image.
+
+    Returns:
+    - EncodedImage: The blob in the 'contour' format.
+    """
+    return rows_to_contour(rle_to_rows(rle_encoded, shape))
+
+def encode_contour_optimized(blob):
+    """
+    Encode a row-convex binary 2D array (blob) in the contour format, see `rows_to_contour`.
+
+    Parameters:
+    - blob (numpy.ndarray): A binary 2D array with one interval on each of a range of
+      consecutive rows.
+
+    Returns:
+    - EncodedImage: The blob in the 'contour' format.
+    """
+    return rows_to_contour(encode_rle_rows_optimized(blob))
+
+def contour_edges(contour):
+    """
+    Expand a contour into the interval of every row it covers.
+
+    Parameters:
+    - contour (EncodedImage): A blob in the 'contour' format.
+
+    Returns:
+    - tuple of numpy.ndarray: `(rows, starts, ends)`, covering columns
+      `starts[i] <= c < ends[i]` of row `rows[i]`.
+    """
+    first_row, rows, left, right = (int(value) for value in contour.arrays['origin'])
+    return (np.arange(first_row, first_row + rows, dtype=np.int64),
+            _expand_edge(left, contour.arrays['left'], rows),
+            _expand_edge(right, contour.arrays['right'], rows))
+
+def contour_to_rows(contour):
+    """
+    Convert a contour into the row-indexed RLE ('rle_rows') format.
+
+    Parameters:
+    - contour (EncodedImage): A blob in the 'contour' format.
+
+    Returns:
+    - EncodedImage: The blob in the 'rle_rows' format.
+    """
+    return encode_row_intervals(*contour_edges(contour), contour.shape)
+
+def contour_to_rle(contour, run_dtype=np.uint16):
+    """
+    Convert a contour into the flat RLE format, identical to `encode_rle_optimized` of the
+    blob with the same `run_dtype`.
+
+    Parameters:
+    - contour (EncodedImage): A blob in the 'contour' format.
+    - run_dtype (numpy.dtype, optional): The dtype of the RLE array. Defaults to np.uint16.
+
+    Returns:
+    - numpy.ndarray: The flat RLE array, alternating values and run lengths.
+    """
+    return rows_to_rle(contour_to_rows(contour), run_dtype)
+
+def _edge_sum(first, runs):
+    """
+    Sum an edge's columns over all rows after the first, relative to the first, in closed
+    form per chain-code run: a run of `count` steps of `step` from column v adds
+    count * (v - first) + step * count * (count + 1) / 2.
+
+    Parameters:
+    - first (int): The column of the edge on the first row of the outline.
+    - runs (numpy.ndarray): The (n, 2) (step, count) pairs of `_delta_runs`.
+
+    Returns:
+    - int: The sum over every row after the first of the edge's column minus `first`.
+    """
+    steps, counts = runs[:, 0].astype(np.int64), runs[:, 1].astype(np.int64)
+    offsets = np.concatenate(([0], np.cumsum(steps * counts)[:-1]))
+    return int(np.sum(counts * offsets + steps * counts * (counts + 1) // 2))
+
+def contour_area(contour):
+    """
+    Compute the exact pixel area of a contour from its outline.
+
+    The area enclosed by the staircase outline (the shoelace formula applied to it) is the
+    sum of the row widths, right edge minus left edge. Along each straight run of the chain
+    codes the edges are arithmetic sequences, so their sums are evaluated in closed form and
+    the cost is proportional to the number of runs, not to the number of rows.
+
+    Parameters:
+    - contour (EncodedImage): A blob in the 'contour' format.
+
+    Returns:
+    - int: The number of blob pixels.
+    """
+    _, rows, left, right = (int(value) for value in contour.arrays['origin'])
+    return (rows * (right - left) + _edge_sum(right, contour.arrays['right'])
+            - _edge_sum(left, contour.arrays['left']))
+
+def contour_contains(contour, rows, cols):
+    """
+    Test which pixels lie inside a contour.
+
+    Each pixel's row is located among the chain-code runs with a binary search and its
+    edges are evaluated there, so the cost is O(log runs) per pixel and the outline is
+    never expanded.
+
+    Parameters:
+    - contour (EncodedImage): A blob in the 'contour' format.
+    - rows (numpy.ndarray): The row of each pixel.
+    - cols (numpy.ndarray): The column of each pixel.
+
+    Returns:
+    - numpy.ndarray: A boolean array, True where the pixel belongs to the blob.
+    """
+    first_row, height, left, right = (int(value) for value in contour.arrays['origin'])
+    offsets = np.asarray(rows, dtype=np.int64) - first_row
+    cols = np.asarray(cols, dtype=np.int64)
+    inside_rows = (offsets >= 0) & (offsets < height)
+    clipped = np.clip(offsets, 0, max(height - 1, 0))
+    return (inside_rows & (cols >= _edge_at(left, contour.arrays['left'], clipped))
+            & (cols < _edge_at(right, contour.arrays['right'], clipped)))
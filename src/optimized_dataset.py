@@ -0,0 +1,184 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from src.optimized_encoding import encode_row_intervals, rows_to_rle
+from src.optimized_contour import rows_to_contour
+from src.optimized_generation import blob_chords, blob_parameters, generate_dye_distribution
+from src.optimized_cancerDetection import score_encoded
+from src.optimized_batch import DYE_FILE, MICROSCOPE_FILE
+from src.storage import save_encoded
+
+MANIFEST_FILE = 'manifest.jsonl'
+BLOB_FORMATS = ('rle', 'rle_rows', 'contour')
+DYE_FORMATS = ('csr', 'coo', 'packed', 'sparse')
+
+def _save(path, encoded, shape):
+    """
+    Save a generated image, either an EncodedImage or a plain RLE or sparse array.
+    """
+    if isinstance(encoded, np.ndarray):
+        kind = 'rle' if encoded.ndim == 1 else 'sparse'
+        return save_encoded(path, kind, shape, {kind: encoded})
+    return save_encoded(path, encoded.format, shape, encoded.arrays)
+
+def generate_sample(seed, sample_id, out_dir, width, height, radius_range=(100, 400), dye_ratio_range=(0.1, 0.1),
+                    blob_format='rle', dye_format='csr'):
+    """
+    Generate one microscope/dye pair, write it to disk and measure its ground truth.
+
+    Every random draw of the sample comes from a generator seeded with `seed` alone, so a
+    sample is the same whichever process generates it and in whatever order.
+
+    Parameters:
+    - seed (numpy.random.SeedSequence): The seed of this sample.
+    - sample_id (str): The id of the sample, also the name of its subdirectory of `out_dir`.
+    - out_dir (str): The dataset directory.
+    - width (int): The width of the images.
+    - height (int): The height of the images.
+    - radius_range (tuple of int, optional): The minimum (inclusive) and maximum (exclusive)
+      blob radius. Defaults to (100, 400).
+    - dye_ratio_range (tuple of float, optional): The range the sample's dye ratio (see
+      `generate_dye_distribution`) is drawn from uniformly. Defaults to (0.1, 0.1).
+    - blob_format (str, optional): The encoding of the microscope file, one of
+      BLOB_FORMATS. Defaults to 'rle'.
+    - dye_format (str, optional): The encoding of the dye file, one of DYE_FORMATS.
+      Defaults to 'csr'.
+
+    Returns:
+    - dict: The manifest record of the sample, see `generate_dataset`.
+    """
+    rng = np.random.default_rng(seed)
+    shape = (height, width)
+    x0, y0, radius = blob_parameters(radius_range, width, height, rng)
+    blob = encode_row_intervals(*blob_chords(x0, y0, radius, width, 0, height), shape)
+    low, high = dye_ratio_range
+    dye_ratio = float(rng.uniform(low, high)) if low < high else float(low)
+    dye = generate_dye_distribution(blob, dye_ratio, output=dye_format, rng=rng)
+
+    sample_dir = os.path.join(out_dir, sample_id)
+    os.makedirs(sample_dir, exist_ok=True)
+    stored_blob = {'rle': rows_to_rle, 'rle_rows': lambda rows: rows, 'contour': rows_to_contour}[blob_format](blob)
+    size = _save(os.path.join(sample_dir, MICROSCOPE_FILE), stored_blob, shape)
+    size += _save(os.path.join(sample_dir, DYE_FILE), dye, shape)
+
+    return dict({'id': sample_id,
+                 'microscope': os.path.join(sample_id, MICROSCOPE_FILE),
+                 'dye': os.path.join(sample_id, DYE_FILE),
+                 'entropy': seed.entropy, 'spawn_key': list(seed.spawn_key),
+                 'width': width, 'height': height, 'center': [x0, y0], 'radius': radius,
+                 'dye_ratio': dye_ratio, 'bytes': size},
+                **score_encoded(dye, blob, shape))
+
+def _generate_chunk(arguments):
+    return [generate_sample(*sample_arguments) for sample_arguments in arguments]
+
+def _check_options(width, height, radius_range, blob_format, dye_format):
+    """
+    Reject dataset options that would only fail inside the worker processes.
+    """
+    if blob_format not in BLOB_FORMATS:
+        raise ValueError(f"blob_format must be one of {BLOB_FORMATS}, got {blob_format!r}")
+    if dye_format not in DYE_FORMATS:
+        raise ValueError(f"dye_format must be one of {DYE_FORMATS}, got {dye_format!r}")
+    low, high = radius_range
+    # `blob_parameters` centers a blob at least its radius away from every edge
+    if not 0 < low < high or 2 * (high - 1) >= min(width, height):
+        raise ValueError(f"radius range {tuple(radius_range)} must satisfy 0 < min < max and "
+                         f"2 * (max - 1) < {min(width, height)} for every blob to fit a "
+                         f"{width}x{height} image")
+
+def generate_dataset(out_dir, samples, width=1000, height=1000, radius_range=(100, 400), dye_ratio_range=(0.1, 0.1),
+                     seed=None, workers=None, blob_format='rle', dye_format='csr'):
+    """
+    Generate a reproducible dataset of microscope/dye pairs on a process pool.
+
+    A root SeedSequence built from `seed` is spawned into one child per sample, so sample i
+    depends only on the root seed and i: the dataset is identical for any number of workers,
+    and growing `samples` leaves the contents of the first samples unchanged. Blobs and dye
+    are generated directly in encoded form, so large slides never need a full-resolution
+    array, and each worker writes its samples' files itself.
+
+    The samples are written as `out_dir/<id>/microscope.bin` and `dye_sensor.bin`, and
+    `out_dir/manifest.jsonl` lists them in order, one record per line, which
+    `optimized_batch.score_batch` accepts as its source. Each record holds 'id',
+    'microscope' and 'dye' (paths relative to `out_dir`), 'entropy' and 'spawn_key' (the
+    sample's SeedSequence), 'width', 'height', 'center', 'radius', 'dye_ratio', 'bytes'
+    (the size of both files) and the ground truth of `score_encoded`: 'blob_area',
+    'dye_in_blob', 'total_area', 'cancer_microscope' and 'cancer_dye'.
+
+    Parameters:
+    - out_dir (str): The dataset directory. It is created if missing.
+    - samples (int): The number of samples.
+    - width (int, optional): The width of the images. Defaults to 1000.
+    - height (int, optional): The height of the images. Defaults to 1000.
+    - radius_range (tuple of int, optional): The blob radius range, see `generate_sample`.
+      Every radius of it must fit the image. Defaults to (100, 400).
+    - dye_ratio_range (tuple of float, optional): The dye ratio range, see
+      `generate_sample`. Defaults to (0.1, 0.1).
+    - seed (int, optional): The root seed. Defaults to None, meaning fresh entropy, which is
+      recorded in the manifest.
+    - workers (int, optional): The number of worker processes. Defaults to None, meaning
+      `os.cpu_count()`.
+    - blob_format (str, optional): The encoding of the microscope files. Defaults to 'rle'.
+    - dye_format (str, optional): The encoding of the dye files. Defaults to 'csr'.
+
+    Returns:
+    - dict: 'samples', 'bytes', 'cancer_microscope' and 'cancer_dye' (the number of positive
+      samples), 'seconds', 'samples_per_second' and 'entropy' (the root seed).
+    """
+    _check_options(width, height, radius_range, blob_format, dye_format)
+    os.makedirs(out_dir, exist_ok=True)
+    root = np.random.SeedSequence(seed)
+    digits = len(str(max(samples - 1, 0)))
+    arguments = [(child, f'sample-{i:0{digits}d}', out_dir, width, height, tuple(radius_range),
+                  tuple(dye_ratio_range), blob_format, dye_format)
+                 for i, child in enumerate(root.spawn(samples))]
+    workers = workers or os.cpu_count()
+    # A few chunks per worker keep the pool busy without a round trip per small sample
+    chunk = max(1, samples // (4 * workers))
+    chunks = [arguments[i:i + chunk] for i in range(0, samples, chunk)]
+    summary = {'samples': samples, 'bytes': 0, 'cancer_microscope': 0, 'cancer_dye': 0}
+    start = time.perf_counter()
+
+    manifest_path = os.path.join(out_dir, MANIFEST_FILE)
+    with ProcessPoolExecutor(max_workers=workers) as executor, open(manifest_path + '.tmp', 'w') as manifest:
+        for records in executor.map(_generate_chunk, chunks):
+            for record in records:
+                manifest.write(json.dumps(record) + '\n')
+                summary['bytes'] += record['bytes']
+                summary['cancer_microscope'] += record['cancer_microscope']
+                summary['cancer_dye'] += record['cancer_dye']
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    seconds = time.perf_counter() - start
+    summary.update(seconds=seconds, samples_per_second=samples / seconds if seconds > 0 else 0.0,
+                   entropy=root.entropy)
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a reproducible dataset of microscope/dye pairs.")
+    parser.add_argument('out_dir')
+    parser.add_argument('--samples', type=int, default=100)
+    parser.add_argument('--width', type=int, default=1000)
+    parser.add_argument('--height', type=int, default=1000)
+    parser.add_argument('--radius-range', type=int, nargs=2, default=(100, 400), metavar=('MIN', 'MAX'))
+    parser.add_argument('--dye-ratio', type=float, nargs=2, default=(0.1, 0.1), metavar=('MIN', 'MAX'),
+                        help="range the dye ratio of each sample is drawn from")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--blob-format', choices=BLOB_FORMATS, default='rle')
+    parser.add_argument('--dye-format', choices=DYE_FORMATS, default='csr')
+    args = parser.parse_args()
+    try:
+        _check_options(args.width, args.height, args.radius_range, args.blob_format, args.dye_format)
+    except ValueError as exc:
+        parser.error(f"{exc}; pass a smaller --radius-range")
+    summary = generate_dataset(args.out_dir, args.samples, args.width, args.height, args.radius_range, args.dye_ratio,
+                               args.seed, args.workers, args.blob_format, args.dye_format)
+    print(f"Generated {summary['samples']} samples ({summary['bytes'] / 1e6:.1f} MB, "
+          f"{summary['cancer_microscope']} microscope and {summary['cancer_dye']} dye positives) "
+          f"in {summary['seconds']:.2f} s with entropy {summary['entropy']}; "
+          f"manifest written to {os.path.join(args.out_dir, MANIFEST_FILE)}")
@@ -1,30 +1,106 @@
 import numpy as np
+from src.optimized_encoding import EncodedImage, row_numbers, rows_band, rows_to_flat_intervals
+from src.optimized_contour import contour_to_rows
 
-def decode_rle_optimized(rle_encoded, shape):
+# Pixels expanded at once into a temporary by the decoders, a multiple of 8
+_DECODE_CHUNK = 2**20
+
+def _prepare_output(shape, dtype, out):
+    """
+    Validate or allocate the buffer a decoder writes into.
+
+    Parameters:
+    - shape (tuple): The shape of the image being decoded.
+    - dtype (numpy.dtype): The requested output dtype, np.uint8 or np.bool_.
+    - out (numpy.ndarray or None): A caller-provided buffer to reuse, or None.
+
+    Returns:
+    - numpy.ndarray: A C-contiguous array of the given shape and dtype. A fresh array is
+      allocated only when `out` is None; its contents are not cleared here.
+    """
+    if out is None:
+        return np.empty(shape, dtype=dtype)
+    if out.shape != tuple(shape):
+        raise ValueError(f"out has shape {out.shape}, expected {tuple(shape)}")
+    if out.dtype not in (np.uint8, np.bool_):
+        raise ValueError(f"out must have dtype uint8 or bool, got {out.dtype}")
+    if not out.flags.c_contiguous:
+        raise ValueError("out must be C-contiguous")
+    return out
+
+def rle_runs(rle_encoded):
+    """
+    Split an RLE array into per-run start offsets, lengths and values.
+
+    Parameters:
+    - rle_encoded (numpy.ndarray): The RLE encoded data as a 1D array of alternating values
+      and run lengths.
+
+    Returns:
+    - tuple of numpy.ndarray: `(starts, lengths, values)`, where `starts` and `lengths` are
+      int64 offsets into the raveled image and `values` is the value of each run.
+    """
+    rle_encoded = np.asarray(rle_encoded)
+    lengths = rle_encoded[1::2].astype(np.int64)
+    starts = np.cumsum(lengths) - lengths
+    return starts, lengths, rle_encoded[::2]
+
+def _fill_runs(flat, ends, values):
+    """
+    Write runs of values into a flat uint8 buffer, one bounded chunk at a time.
+
+    The runs overlapping each chunk of the buffer are found by binary search on their end
+    offsets and expanded with `np.repeat` into a temporary of at most _DECODE_CHUNK pixels,
+    so the decoder keeps the speed of a batched expansion without allocating anything the
+    size of the image. Pixels after the last run are set to 0, and runs past the end of the
+    buffer are ignored.
+
+    Parameters:
+    - flat (numpy.ndarray): The 1D uint8 buffer to fill.
+    - ends (numpy.ndarray): The non-decreasing int64 end offset of each run.
+    - values (numpy.ndarray): The uint8 value of each run.
+    """
+    for first in range(0, flat.size, _DECODE_CHUNK):
+        last = min(first + _DECODE_CHUNK, flat.size)
+        low = np.searchsorted(ends, first, side='right')
+        high = np.searchsorted(ends, last, side='left') + 1
+        lengths = np.diff(np.clip(ends[low:high], first, last), prepend=first)
+        segment = np.repeat(values[low:high], lengths)
+        flat[first:first + segment.size] = segment
+        flat[first + segment.size:last] = 0
+
+def decode_rle_optimized(rle_encoded, shape, out=None, dtype=np.uint8):
     """
     Decode a run-length encoded (RLE) array to its original array representation,
     optimized for efficiency.
 
-    This function reconstructs the original array from its RLE format, where the
-    encoding consists of alternating values and their frequencies.
+    The runs are expanded with batched `np.repeat` calls straight into the output buffer, a
+    bounded chunk at a time, instead of assigning each run in a Python loop or expanding
+    them into a temporary image. A caller decoding many images can pass the same `out`
+    buffer every time, so decoding allocates nothing proportional to the image.
 
     Parameters:
     - rle_encoded (numpy.ndarray): The RLE encoded data as a 1D array.
     - shape (tuple): The shape of the original array to be reconstructed.
+    - out (numpy.ndarray, optional): A C-contiguous uint8 or bool array of shape `shape` to
+      decode into. Its previous contents are overwritten. Defaults to None, which allocates
+      a new array.
+    - dtype (numpy.dtype, optional): The dtype of the allocated array when `out` is None,
+      np.uint8 or np.bool_. Defaults to np.uint8.
 
     Returns:
-    - numpy.ndarray: The decoded 2D array of the specified shape.
-    """
-    decoded = np.zeros(shape, dtype=np.uint8)
-    ends = np.cumsum(rle_encoded[1::2])  
-    starts = ends - rle_encoded[1::2]  
-    values = rle_encoded[::2]
-    for start, end, value in zip(starts, ends, values):
-        decoded.ravel()[start:end] = value
-    
+    - numpy.ndarray: The decoded 2D array of the specified shape (`out` if it was given).
+
+    Note:
+    - Values must fit in np.uint8.
+    """
+    decoded = _prepare_output(shape, dtype, out)
+    flat = decoded.reshape(-1).view(np.uint8)
+    rle_encoded = np.asarray(rle_encoded)
+    _fill_runs(flat, np.cumsum(rle_encoded[1::2], dtype=np.int64), rle_encoded[::2].astype(np.uint8))
     return decoded
 
-def decode_sparse_matrix_optimized(sparse_matrix, shape):
+def decode_sparse_matrix_optimized(sparse_matrix, shape, out=None, dtype=np.uint8):
     """
     Decode a sparse matrix representation to its original 2D array form,
     optimized for efficiency.
@@ -33,13 +109,96 @@ def decode_sparse_matrix_optimized(sparse_matrix, shape):
     non-zero elements, is converted back to the original dense 2D array format.
 
     Parameters:
-    - sparse_matrix (numpy.ndarray): A 2D array of sparse matrix entries.
+    - sparse_matrix (numpy.ndarray or EncodedImage): A 2D array of sparse matrix entries, or
+      a dye distribution encoded by `encode_dye_optimized` in any of its formats.
     - shape (tuple): The shape of the original 2D array to be reconstructed.
+    - out (numpy.ndarray, optional): A C-contiguous uint8 or bool array of shape `shape` to
+      decode into. Its previous contents are overwritten. Defaults to None, which allocates
+      a new array.
+    - dtype (numpy.dtype, optional): The dtype of the allocated array when `out` is None,
+      np.uint8 or np.bool_. Defaults to np.uint8.
 
     Returns:
-    - numpy.ndarray: The decoded 2D array of the specified shape.
+    - numpy.ndarray: The decoded 2D array of the specified shape (`out` if it was given).
     """
-    decoded = np.zeros(shape, dtype=np.uint8)
-    rows, cols, values = sparse_matrix.T
+    if isinstance(sparse_matrix, EncodedImage):
+        return decode_encoded_optimized(sparse_matrix, shape, out=out, dtype=dtype)
+    decoded = _prepare_output(shape, dtype, out)
+    decoded.fill(0)
+    rows, cols, values = np.asarray(sparse_matrix).reshape(-1, 3).T
     decoded[rows, cols] = values
     return decoded
+
+def decode_encoded_optimized(encoded, shape=None, out=None, dtype=np.uint8):
+    """
+    Decode an EncodedImage to its original 2D array form, dispatching on its format.
+
+    Parameters:
+    - encoded (EncodedImage): An image encoded as 'packed', 'coo', 'csr', 'rle', 'rle_rows',
+      'contour' or 'sparse'.
+    - shape (tuple, optional): The shape of the original 2D array. Defaults to None, which
+      uses `encoded.shape`.
+    - out (numpy.ndarray, optional): A C-contiguous uint8 or bool array to decode into.
+      Defaults to None, which allocates a new array.
+    - dtype (numpy.dtype, optional): The dtype of the allocated array when `out` is None,
+      np.uint8 or np.bool_. Defaults to np.uint8.
+
+    Returns:
+    - numpy.ndarray: The decoded 2D array (`out` if it was given).
+    """
+    shape = encoded.shape if shape is None else shape
+    arrays = encoded.arrays
+    if encoded.format == 'rle':
+        return decode_rle_optimized(arrays['rle'], shape, out=out, dtype=dtype)
+    if encoded.format == 'sparse':
+        return decode_sparse_matrix_optimized(arrays['sparse'], shape, out=out, dtype=dtype)
+    if encoded.format == 'rle_rows':
+        return decode_rows(encoded, 0, shape[0], out=out, dtype=dtype)
+    if encoded.format == 'contour':
+        return decode_rows(contour_to_rows(encoded), 0, shape[0], out=out, dtype=dtype)
+    decoded = _prepare_output(shape, dtype, out)
+    if encoded.format == 'packed':
+        flat = decoded.reshape(-1).view(np.uint8)
+        # Unpack a bounded chunk at a time rather than the whole image into a temporary
+        for first in range(0, flat.size, _DECODE_CHUNK):
+            last = min(first + _DECODE_CHUNK, flat.size)
+            flat[first:last] = np.unpackbits(arrays['bits'][first // 8:(last + 7) // 8], count=last - first)
+    elif encoded.format == 'coo':
+        decoded.fill(0)
+        decoded[arrays['rows'], arrays['cols']] = 1
+    elif encoded.format == 'csr':
+        decoded.fill(0)
+        rows = row_numbers(arrays['indptr'])
+        decoded[rows, arrays['indices']] = 1
+    else:
+        raise ValueError(f"Unknown encoding format {encoded.format!r}")
+    return decoded
+
+def decode_rows(rows_encoded, start, stop, out=None, dtype=np.uint8):
+    """
+    Decode rows `start <= r < stop` of a row-indexed RLE ('rle_rows') encoding.
+
+    Only the intervals of the requested rows are read, located through the row pointers,
+    so the cost is proportional to the size of the band rather than to the rows in front
+    of it.
+
+    Parameters:
+    - rows_encoded (EncodedImage): A blob in the 'rle_rows' format, see `rle_to_rows`.
+    - start (int): The first row to decode.
+    - stop (int): The row after the last row to decode. The range is clipped to the image.
+    - out (numpy.ndarray, optional): A C-contiguous uint8 or bool array of shape
+      (rows in the band, width) to decode into. Defaults to None, which allocates a new array.
+    - dtype (numpy.dtype, optional): The dtype of the allocated array when `out` is None,
+      np.uint8 or np.bool_. Defaults to np.uint8.
+
+    Returns:
+    - numpy.ndarray: The decoded band, 1 inside the blob and 0 elsewhere.
+    """
+    band = rows_band(rows_encoded, start, stop)
+    starts, ends = rows_to_flat_intervals(band)
+    decoded = _prepare_output(band.shape, dtype, out)
+    flat = decoded.reshape(-1).view(np.uint8)
+    # Alternate runs of 0 (up to each interval) and 1 (the interval itself)
+    boundaries = np.column_stack((starts, ends)).ravel().astype(np.int64)
+    _fill_runs(flat, boundaries, np.resize(np.array([0, 1], dtype=np.uint8), boundaries.size))
+    return decoded
@@ -1,35 +1,167 @@
 import numpy as np
+from src.optimized_encoding import EncodedImage, encode_dye_positions, encode_rle_optimized, encode_row_intervals, rows_to_rle
+from src.optimized_decoding import decode_encoded_optimized
+from src.optimized_cancerDetection import blob_intervals
+from src.optimized_contour import rows_to_contour
 
 WIDTH, HEIGHT = 1000, 1000
 
-def generate_blob(radius_range=(100, 400)):
+def blob_chords(x0, y0, radius, width, row_start, row_stop):
+    """
+    Compute the chord of a circular blob on each row of a band, without a pixel grid.
+
+    A pixel (x, y) belongs to the blob when (x - x0)**2 + (y - y0)**2 <= radius**2, so on
+    row y the blob covers the columns |x - x0| <= isqrt(radius**2 - (y - y0)**2).
+
+    Parameters:
+    - x0 (int): The column of the blob's center.
+    - y0 (int): The row of the blob's center.
+    - radius (int): The radius of the blob.
+    - width (int): The width of the image; chords are clipped to it.
+    - row_start (int): The first row of the band.
+    - row_stop (int): The row after the last row of the band.
+
+    Returns:
+    - tuple of numpy.ndarray: `(rows, starts, ends)`, one entry per row of the band that the
+      blob crosses, covering columns `starts[i] <= x < ends[i]` of row `rows[i]`.
+    """
+    rows = np.arange(max(row_start, y0 - radius), min(row_stop, y0 + radius + 1), dtype=np.int64)
+    remaining = radius * radius - (rows - y0) ** 2
+    half_chord = np.floor(np.sqrt(remaining)).astype(np.int64)
+    half_chord -= half_chord * half_chord > remaining
+    half_chord += (half_chord + 1) ** 2 <= remaining
+    starts = np.maximum(x0 - half_chord, 0)
+    ends = np.minimum(x0 + half_chord + 1, width)
+    return rows, starts, ends
+
+def blob_parameters(radius_range=(100, 400), width=WIDTH, height=HEIGHT, rng=None):
+    """
+    Draw the radius and center of a random circular blob that fits inside the image.
+
+    Parameters:
+    - radius_range (tuple of int, optional): The minimum (inclusive) and maximum (exclusive)
+      radius. Defaults to (100, 400).
+    - width (int, optional): The width of the image. Defaults to WIDTH.
+    - height (int, optional): The height of the image. Defaults to HEIGHT.
+    - rng (numpy.random.Generator or int, optional): The generator, or a seed for one.
+      Defaults to None, which uses the global np.random state.
+
+    Returns:
+    - tuple of int: `(x0, y0, radius)`, the column and row of the center and the radius.
+    """
+    if rng is None:
+        radius = np.random.randint(radius_range[0], radius_range[1])
+        return np.random.randint(radius, width - radius), np.random.randint(radius, height - radius), radius
+    rng = np.random.default_rng(rng)
+    radius = int(rng.integers(radius_range[0], radius_range[1]))
+    return int(rng.integers(radius, width - radius)), int(rng.integers(radius, height - radius)), radius
+
+def generate_blob(radius_range=(100, 400), width=WIDTH, height=HEIGHT, output='dense', rng=None):
     """
     Generates a circular blob within a specified radius range on a 2D grid.
 
-    This function creates a binary array of shape (HEIGHT, WIDTH), representing an image
+    This function creates a binary array of shape (height, width), representing an image
     where a circular blob is marked by True (1) values, and the background is False (0).
     The position of the blob is randomly determined, as is its radius, within the provided range.
 
+    Each row of a circle is a single chord whose ends follow from the radius, so the blob is
+    built from one chord per row instead of a full grid of distances. The encoded outputs
+    never allocate anything proportional to the image area.
+
     Parameters:
     - radius_range (tuple of int, optional): A tuple specifying the minimum and maximum
       possible radii for the blob. Defaults to (100, 400).
+    - width (int, optional): The width of the image. Defaults to WIDTH.
+    - height (int, optional): The height of the image. Defaults to HEIGHT.
+    - output (str, optional): 'dense' for a boolean array, 'rows' for a row-indexed RLE
+      EncodedImage ('rle_rows'), 'rle' for the flat RLE of `encode_rle_optimized`, or
+      'contour' for the outline EncodedImage of `rows_to_contour`. Defaults to 'dense'.
+    - rng (numpy.random.Generator or int, optional): The generator, or a seed for one, that
+      places the blob. Defaults to None, which uses the global np.random state.
 
     Returns:
-    - numpy.ndarray: A 2D binary numpy array of shape (HEIGHT, WIDTH) with a single blob
-                     generated according to the specified parameters.
+    - numpy.ndarray or EncodedImage: The blob in the requested output form.
 
     Note:
     - The generated blob is guaranteed not to touch the edges of the image, adhering to the
       specified radius constraints.
+    - With rng=None the random draws are the same as before, so a given np.random seed
+      produces the same blob in every output form.
     """
-    radius = np.random.randint(radius_range[0], radius_range[1])
-    x0, y0 = np.random.randint(radius, WIDTH - radius), np.random.randint(radius, HEIGHT - radius)
-    Y, X = np.indices((HEIGHT, WIDTH))
-    dist_from_center = np.sqrt((X - x0)**2 + (Y - y0)**2)
-    blob = dist_from_center <= radius
-    return blob
+    x0, y0, radius = blob_parameters(radius_range, width, height, rng)
+    rows_encoded = encode_row_intervals(*blob_chords(x0, y0, radius, width, 0, height), (height, width))
+    if output == 'rows':
+        return rows_encoded
+    if output == 'rle':
+        return rows_to_rle(rows_encoded)
+    if output == 'contour':
+        return rows_to_contour(rows_encoded)
+    if output == 'dense':
+        return decode_encoded_optimized(rows_encoded, dtype=bool)
+    raise ValueError(f"output must be 'dense', 'rows', 'rle' or 'contour', got {output!r}")
 
-def generate_dye_distribution(blob, dye_ratio=0.1):
+def sample_in_intervals(rng, starts, ends, probability):
+    """
+    Select each pixel of a set of intervals independently with a given probability.
+
+    Instead of drawing one random number per pixel, the gaps between selected pixels are
+    drawn from a geometric distribution, which yields exactly the same distribution (the
+    number selected is Binomial(pixels, probability)) in time and memory proportional to
+    the number of pixels selected.
+
+    Parameters:
+    - rng (numpy.random.Generator): The random number generator.
+    - starts (numpy.ndarray): Sorted start offsets of disjoint intervals of the raveled image.
+    - ends (numpy.ndarray): Exclusive end offsets, matching `starts`.
+    - probability (float): The probability that each pixel is selected.
+
+    Returns:
+    - numpy.ndarray: The sorted int64 offsets of the selected pixels.
+    """
+    starts, ends = np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64)
+    lengths = ends - starts
+    total = int(np.sum(lengths))
+    if total == 0 or probability <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if probability >= 1:
+        ranks = np.arange(total, dtype=np.int64)
+    else:
+        expected = total * probability
+        batch = int(expected + 5 * np.sqrt(expected) + 16)
+        chunks, position = [], -1
+        while position < total - 1:
+            ranks = position + np.cumsum(rng.geometric(probability, size=batch))
+            chunks.append(ranks)
+            position = int(ranks[-1])
+        ranks = np.concatenate(chunks)
+        ranks = ranks[ranks < total]
+    covered = np.cumsum(lengths)
+    interval = np.searchsorted(covered, ranks, side='right')
+    return starts[interval] + ranks - (covered[interval] - lengths[interval])
+
+def sample_dye_positions(rng, starts, ends, total_pixels, dye_ratio=0.1):
+    """
+    Sample the dyed pixels of an image from the blob's intervals.
+
+    Parameters:
+    - rng (numpy.random.Generator): The random number generator.
+    - starts (numpy.ndarray): Sorted start offsets of the blob's intervals in the raveled image.
+    - ends (numpy.ndarray): Exclusive end offsets, matching `starts`.
+    - total_pixels (int): The number of pixels in the image.
+    - dye_ratio (float, optional): The dye probability outside the blob; inside the blob it
+      is doubled. Defaults to 0.1.
+
+    Returns:
+    - numpy.ndarray: The sorted int64 offsets of the dyed pixels.
+    """
+    outside_starts = np.concatenate(([0], ends))
+    outside_ends = np.concatenate((starts, [total_pixels]))
+    return np.sort(np.concatenate((
+        sample_in_intervals(rng, starts, ends, dye_ratio * 2),
+        sample_in_intervals(rng, outside_starts, outside_ends, dye_ratio),
+    )))
+
+def generate_dye_distribution(blob, dye_ratio=0.1, output='dense', rng=None):
     """
     Generates a random dye distribution for a given blob within a 2D space.
 
@@ -38,23 +170,48 @@ def generate_dye_distribution(blob, dye_ratio=0.1):
     inside the blob than outside, simulating a common pattern in biological imaging where
     a region of interest reacts differently to staining or dyeing processes.
 
+    With output='dense' and rng=None the original method is used: two dense fields of
+    uniform random numbers are drawn, masked and combined. Otherwise the dyed pixels are
+    sampled directly inside and outside the blob's intervals with `sample_in_intervals`,
+    so the cost tracks the number of dyed pixels rather than the image area.
+
     Parameters:
-    - blob (numpy.ndarray): A binary 2D numpy array representing an area with a blob (marked by 1)
-                            against a background (marked by 0).
+    - blob (numpy.ndarray or EncodedImage): A binary 2D numpy array representing an area
+      with a blob (marked by 1) against a background (marked by 0), or the blob as an 'rle'
+      or 'rle_rows' EncodedImage (for example from `generate_blob(output='rows')`).
     - dye_ratio (float, optional): The base probability of dye presence outside the blob.
                                    Inside the blob, the probability is doubled. Defaults to 0.1.
+    - output (str, optional): 'dense' for a boolean array, 'sparse' for the (n, 3) array of
+      `encode_sparse_matrix_optimized`, or 'packed', 'coo' or 'csr' for an EncodedImage as
+      produced by `encode_dye_optimized`. Defaults to 'dense'.
+    - rng (numpy.random.Generator or int, optional): The generator, or a seed for one.
+      Defaults to None, which uses the global np.random state for dense output and a
+      freshly seeded generator otherwise.
 
     Returns:
-    - numpy.ndarray: A 2D binary numpy array of the same shape as `blob`, indicating the dye
-                     distribution, with True for dyed pixels and False for undyed pixels.
+    - numpy.ndarray or EncodedImage: The dye distribution in the requested output form.
 
     Note:
     - The function generates dye distribution both inside and outside the blob but ensures that
       the probability of dye presence is higher within the blob to mimic selective staining.
     """
-    dye_inside = np.random.rand(*blob.shape) < dye_ratio * 2
-    dye_inside[~blob] = False 
-    dye_outside = np.random.rand(*blob.shape) < dye_ratio
-    dye_outside[blob] = False  
-    dye_distribution = dye_inside | dye_outside
-    return dye_distribution
+    if output == 'dense' and rng is None and not isinstance(blob, EncodedImage):
+        dye_inside = np.random.rand(*blob.shape) < dye_ratio * 2
+        dye_inside[~blob] = False
+        dye_outside = np.random.rand(*blob.shape) < dye_ratio
+        dye_outside[blob] = False
+        dye_distribution = dye_inside | dye_outside
+        return dye_distribution
+
+    rng = np.random.default_rng(rng)
+    shape = blob.shape
+    if isinstance(blob, EncodedImage):
+        starts, ends = blob_intervals(blob)
+    else:
+        starts, ends = blob_intervals(encode_rle_optimized(blob != 0, run_dtype=np.uint64))
+    positions = sample_dye_positions(rng, starts, ends, shape[0] * shape[1], dye_ratio)
+    if output == 'dense':
+        dye_distribution = np.zeros(shape, dtype=bool)
+        dye_distribution.ravel()[positions] = True
+        return dye_distribution
+    return encode_dye_positions(positions, shape, format=output)
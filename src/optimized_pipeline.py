@@ -0,0 +1,166 @@
+import numpy as np
+from src.optimized_encoding import encode_dye_positions, encode_row_intervals, rows_to_rle
+from src.optimized_decoding import decode_encoded_optimized
+from src.optimized_generation import blob_chords, blob_parameters, sample_dye_positions
+from src.optimized_cancerDetection import (blob_intervals, cancer_verdicts, count_dye_in_blob, has_cancer_dye_optimized,
+                                           has_cancer_microscope_optimized)
+
+DEFAULT_TILE_BUDGET = 64 * 2**20
+
+def band_rows_for_budget(width, tile_budget=DEFAULT_TILE_BUDGET, dye_ratio=0.1):
+    """
+    Choose how many rows each band may hold so that one band's working set fits a budget.
+
+    A band holds one blob interval per row and, at most, a dye probability of 2 * dye_ratio
+    per pixel. Each dyed pixel costs about 64 bytes while it is sampled, sorted and encoded.
+
+    Parameters:
+    - width (int): The width of the image.
+    - tile_budget (int, optional): The memory budget for one band in bytes. Defaults to
+      DEFAULT_TILE_BUDGET (64 MiB).
+    - dye_ratio (float, optional): The dye probability outside the blob. Defaults to 0.1.
+
+    Returns:
+    - int: The number of rows per band, at least 1.
+    """
+    bytes_per_row = 64 + 64 * width * min(2 * dye_ratio, 1.0)
+    return max(1, int(tile_budget // bytes_per_row))
+
+def generate_bands(width, height, band_rows, radius_range=(100, 400), dye_ratio=0.1, seed=None):
+    """
+    Generate a blob and dye image pair band by band (the generate stage).
+
+    The blob's center and radius are drawn once; each band then gets the blob's chords on
+    its rows and dye sampled inside and outside them with `sample_dye_positions`. Every band
+    has its own generator spawned from `seed`, so a run is reproducible for a given seed and
+    band size. Nothing proportional to the whole image is allocated.
+
+    Parameters:
+    - width (int): The width of the image.
+    - height (int): The height of the image.
+    - band_rows (int): The number of rows per band.
+    - radius_range (tuple of int, optional): The blob radius range. Defaults to (100, 400).
+    - dye_ratio (float, optional): The dye probability outside the blob; it is doubled inside.
+      Defaults to 0.1.
+    - seed (int, optional): The seed of the whole image. Defaults to None (fresh entropy).
+
+    Yields:
+    - tuple: `(row_start, blob_band, dye_band)`, where both bands are EncodedImages of shape
+      (rows in the band, width): the blob in the 'rle_rows' format and the dye in 'csr'.
+    """
+    n_bands = -(-height // band_rows)
+    blob_seed, *band_seeds = np.random.SeedSequence(seed).spawn(n_bands + 1)
+    x0, y0, radius = blob_parameters(radius_range, width, height, np.random.default_rng(blob_seed))
+    for band, row_start in enumerate(range(0, height, band_rows)):
+        row_stop = min(row_start + band_rows, height)
+        shape = (row_stop - row_start, width)
+        rows, starts, ends = blob_chords(x0, y0, radius, width, row_start, row_stop)
+        blob_band = encode_row_intervals(rows - row_start, starts, ends, shape)
+        starts, ends = blob_intervals(blob_band)
+        positions = sample_dye_positions(np.random.default_rng(band_seeds[band]), starts, ends,
+                                         shape[0] * width, dye_ratio)
+        yield row_start, blob_band, encode_dye_positions(positions, shape, format='csr')
+
+def encode_bands(bands, sink=None):
+    """
+    Encode the blob of each band as a flat RLE (the encode stage).
+
+    Parameters:
+    - bands (iterable): `(row_start, blob_band, dye_band)` tuples from `generate_bands`.
+    - sink (callable, optional): Called as `sink(row_start, rle_band, dye_band)` for every
+      band, for example to write the encodings to disk. Defaults to None.
+
+    Yields:
+    - tuple: `(row_start, rle_band, dye_band)`, where `rle_band` is the band's blob as a
+      uint32 flat RLE array.
+    """
+    for row_start, blob_band, dye_band in bands:
+        rle_band = rows_to_rle(blob_band, run_dtype=np.uint32)
+        if sink is not None:
+            sink(row_start, rle_band, dye_band)
+        yield row_start, rle_band, dye_band
+
+def detect_bands(encoded_bands, width, height):
+    """
+    Accumulate the blob area and dye-in-blob count over the bands (the detect stage).
+
+    Parameters:
+    - encoded_bands (iterable): `(row_start, rle_band, dye_band)` tuples from `encode_bands`.
+    - width (int): The width of the image.
+    - height (int): The height of the image.
+
+    Returns:
+    - dict: 'blob_area', 'dye_in_blob', 'total_area', 'bands', and the verdicts
+      'cancer_microscope' (blob area above 25% of the image) and 'cancer_dye' (dye inside
+      the blob above 10% of its area, only tested when the microscope verdict is True).
+    """
+    blob_area = dye_in_blob = bands = 0
+    for row_start, rle_band, dye_band in encoded_bands:
+        starts, ends = blob_intervals(rle_band)
+        blob_area += int(np.sum(ends - starts))
+        dye_in_blob += count_dye_in_blob(dye_band, rle_band, dye_band.shape)
+        bands += 1
+    return dict(blob_area=blob_area, dye_in_blob=dye_in_blob, total_area=width * height, bands=bands,
+                **cancer_verdicts(blob_area, dye_in_blob, width * height))
+
+def run_streaming(width, height, tile_budget=DEFAULT_TILE_BUDGET, radius_range=(100, 400),
+                  dye_ratio=0.1, seed=None, sink=None):
+    """
+    Generate, encode and score an image pair one band at a time.
+
+    The stages are chained generators, so only one band is alive at any moment and peak
+    memory is bounded by `tile_budget` regardless of the image size.
+
+    Parameters:
+    - width (int): The width of the image.
+    - height (int): The height of the image.
+    - tile_budget (int, optional): The memory budget for one band in bytes. Defaults to
+      DEFAULT_TILE_BUDGET (64 MiB).
+    - radius_range (tuple of int, optional): The blob radius range. Defaults to (100, 400).
+    - dye_ratio (float, optional): The dye probability outside the blob. Defaults to 0.1.
+    - seed (int, optional): The seed of the whole image. Defaults to None (fresh entropy).
+    - sink (callable, optional): Receives every encoded band, see `encode_bands`.
+
+    Returns:
+    - dict: The result of `detect_bands`, plus 'band_rows'.
+    """
+    band_rows = band_rows_for_budget(width, tile_budget, dye_ratio)
+    bands = generate_bands(width, height, band_rows, radius_range, dye_ratio, seed)
+    result = detect_bands(encode_bands(bands, sink), width, height)
+    result['band_rows'] = band_rows
+    return result
+
+def run_dense(width, height, band_rows, radius_range=(100, 400), dye_ratio=0.1, seed=None):
+    """
+    Score the same image pair as `run_streaming` by decoding it whole and using the dense
+    detectors. This is the reference the streaming result must match; it needs the full
+    images in memory.
+
+    Parameters:
+    - width (int): The width of the image.
+    - height (int): The height of the image.
+    - band_rows (int): The band size the streaming run used, which fixes the random draws.
+    - radius_range (tuple of int, optional): The blob radius range. Defaults to (100, 400).
+    - dye_ratio (float, optional): The dye probability outside the blob. Defaults to 0.1.
+    - seed (int, optional): The seed of the whole image.
+
+    Returns:
+    - dict: The same keys as `detect_bands`.
+    """
+    blob = np.empty((height, width), dtype=bool)
+    dye_distribution = np.empty((height, width), dtype=bool)
+    bands = 0
+    for row_start, blob_band, dye_band in generate_bands(width, height, band_rows, radius_range, dye_ratio, seed):
+        row_stop = row_start + blob_band.shape[0]
+        decode_encoded_optimized(blob_band, out=blob[row_start:row_stop])
+        decode_encoded_optimized(dye_band, out=dye_distribution[row_start:row_stop])
+        bands += 1
+    cancer_microscope = has_cancer_microscope_optimized(blob)
+    return {
+        'blob_area': int(np.sum(blob)),
+        'dye_in_blob': int(np.sum(dye_distribution & blob)),
+        'total_area': blob.size,
+        'bands': bands,
+        'cancer_microscope': bool(cancer_microscope),
+        'cancer_dye': bool(cancer_microscope and has_cancer_dye_optimized(dye_distribution, blob)),
+    }
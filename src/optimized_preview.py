@@ -0,0 +1,256 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from src.optimized_encoding import EncodedImage, rle_to_rows, row_numbers
+from src.optimized_contour import contour_to_rows
+
+PREVIEW_MODES = ('mean', 'max')
+
+# Intervals processed at once when measuring tile coverage, bounding the temporaries to
+# about this many elements
+_CHUNK_ELEMENTS = 2**22
+# Pixels of a point encoding yielded at once by `_pixel_chunks`
+_POINT_CHUNK = 2**20
+
+def _tile_edges(size, tiles):
+    """
+    Split `size` pixels into `tiles` near-equal tiles and return the tile edges (tiles + 1
+    int64 offsets starting at 0 and ending at `size`).
+    """
+    return np.arange(tiles + 1, dtype=np.int64) * size // tiles
+
+def _blob_rows(encoded, shape):
+    """
+    Return an interval encoding as per-row intervals `(rows, starts, ends)`, or None if the
+    encoding holds individual pixels rather than intervals.
+    """
+    if isinstance(encoded, EncodedImage):
+        if encoded.format == 'rle_rows':
+            rows_encoded = encoded
+        elif encoded.format == 'rle':
+            rows_encoded = rle_to_rows(encoded.arrays['rle'], shape)
+        elif encoded.format == 'contour':
+            rows_encoded = contour_to_rows(encoded)
+        else:
+            return None
+    elif np.ndim(encoded) == 1:
+        rows_encoded = rle_to_rows(encoded, shape)
+    else:
+        return None
+    rows = row_numbers(rows_encoded.arrays['row_ptr'])
+    return (rows, rows_encoded.arrays['starts'].astype(np.int64),
+            rows_encoded.arrays['ends'].astype(np.int64))
+
+def _pixel_chunks(encoded, shape):
+    """
+    Yield the `(rows, cols)` of the set pixels of a point encoding in bounded chunks.
+
+    Parameters:
+    - encoded (numpy.ndarray or EncodedImage): An (n, 3) sparse matrix, or an EncodedImage
+      in the 'sparse', 'coo', 'csr' or 'packed' format.
+    - shape (tuple): The (height, width) of the image.
+    """
+    height, width = shape
+    if not isinstance(encoded, EncodedImage):
+        encoded = EncodedImage('sparse', tuple(shape), {'sparse': np.asarray(encoded).reshape(-1, 3)})
+    arrays = encoded.arrays
+    if encoded.format == 'sparse':
+        entries = arrays['sparse']
+        for first in range(0, entries.shape[0], _POINT_CHUNK):
+            rows, cols, values = entries[first:first + _POINT_CHUNK].T
+            yield rows[values != 0].astype(np.int64), cols[values != 0].astype(np.int64)
+    elif encoded.format == 'coo':
+        for first in range(0, arrays['rows'].size, _POINT_CHUNK):
+            yield (arrays['rows'][first:first + _POINT_CHUNK].astype(np.int64),
+                   arrays['cols'][first:first + _POINT_CHUNK].astype(np.int64))
+    elif encoded.format == 'csr':
+        indptr = arrays['indptr'].astype(np.int64)
+        row_start = 0
+        while row_start < height:
+            # A band of whole rows holding about _POINT_CHUNK entries, at least one row
+            row_stop = min(max(np.searchsorted(indptr, indptr[row_start] + _POINT_CHUNK, side='right') - 1,
+                               row_start + 1), height)
+            yield (row_numbers(indptr[row_start:row_stop + 1], row_start),
+                   arrays['indices'][indptr[row_start]:indptr[row_stop]].astype(np.int64))
+            row_start = row_stop
+    elif encoded.format == 'packed':
+        # Unpack a band of rows at a time so a large slide is never expanded whole
+        band_rows = max(1, _POINT_CHUNK // width)
+        for row_start in range(0, height, band_rows):
+            first = row_start * width
+            last = min(row_start + band_rows, height) * width
+            bits = np.unpackbits(arrays['bits'][first // 8:(last + 7) // 8])
+            flat = np.flatnonzero(bits[first % 8:first % 8 + last - first]) + first
+            yield flat // width, flat % width
+    else:
+        raise ValueError(f"Unsupported encoding format {encoded.format!r}")
+
+def _interval_coverage(rows, starts, ends, row_edges, col_edges):
+    """
+    Sum, for every tile, the number of pixels covered by per-row intervals.
+
+    The pixels of interval [s, e) left of column x number clip(x - s, 0, e - s), so the
+    coverage of every column tile follows from evaluating that at the tile edges. Rows are
+    sorted, so the intervals of one tile row are contiguous and are summed with reduceat.
+    """
+    coverage = np.zeros((row_edges.size - 1, col_edges.size - 1), dtype=np.int64)
+    tile_rows = np.searchsorted(row_edges, rows, side='right') - 1
+    chunk = max(1, _CHUNK_ELEMENTS // col_edges.size)
+    for first in range(0, rows.size, chunk):
+        tile_row = tile_rows[first:first + chunk]
+        start = starts[first:first + chunk, None]
+        left_of_edges = np.clip(col_edges - start, 0, ends[first:first + chunk, None] - start)
+        per_interval = np.diff(left_of_edges, axis=1)
+        groups = np.flatnonzero(np.diff(tile_row, prepend=-1))
+        coverage[tile_row[groups]] += np.add.reduceat(per_interval, groups, axis=0)
+    return coverage
+
+def tile_coverage(encoded, row_edges, col_edges, shape):
+    """
+    Count the set pixels of an encoded image in every tile of a grid, without decoding it.
+
+    Parameters:
+    - encoded (numpy.ndarray or EncodedImage): The encoded image, see `thumbnail`.
+    - row_edges (numpy.ndarray): Sorted int64 tile boundaries along the rows, from 0 to the
+      image height.
+    - col_edges (numpy.ndarray): Sorted int64 tile boundaries along the columns, from 0 to
+      the image width.
+    - shape (tuple): The (height, width) of the image.
+
+    Returns:
+    - numpy.ndarray: An int64 array of shape (len(row_edges) - 1, len(col_edges) - 1).
+    """
+    blob_rows = _blob_rows(encoded, shape)
+    if blob_rows is not None:
+        return _interval_coverage(*blob_rows, row_edges, col_edges)
+    tiles_wide = col_edges.size - 1
+    coverage = np.zeros((row_edges.size - 1) * tiles_wide, dtype=np.int64)
+    for rows, cols in _pixel_chunks(encoded, shape):
+        tiles = ((np.searchsorted(row_edges, rows, side='right') - 1) * tiles_wide
+                 + np.searchsorted(col_edges, cols, side='right') - 1)
+        coverage += np.bincount(tiles, minlength=coverage.size)
+    return coverage.reshape(row_edges.size - 1, tiles_wide)
+
+def thumbnail(encoded, thumb_shape, shape=None, mode='mean'):
+    """
+    Downsample an encoded image into a small grayscale thumbnail without decoding it.
+
+    The image is cut into a grid of near-equal tiles. Blob encodings are measured interval
+    by interval and point encodings pixel by pixel, so the cost grows with the size of the
+    encoding and of the thumbnail rather than with the image area.
+
+    Parameters:
+    - encoded (numpy.ndarray or EncodedImage): A blob as a flat RLE array or an 'rle',
+      'rle_rows' or 'contour' EncodedImage, or a dye distribution as an (n, 3) sparse
+      matrix or an EncodedImage in any format of `encode_dye_optimized`.
+    - thumb_shape (tuple): The (height, width) of the thumbnail. It is capped at the image
+      size.
+    - shape (tuple, optional): The (height, width) of the image. Defaults to None, meaning
+      the shape of `encoded`, which must then be an EncodedImage.
+    - mode (str, optional): 'mean' for the fraction of set pixels in each tile (area
+      averaging), or 'max' for 1 where a tile holds any set pixel (max pooling). Defaults to
+      'mean'.
+
+    Returns:
+    - numpy.ndarray: A float32 array of shape `thumb_shape` with values in [0, 1].
+    """
+    if mode not in PREVIEW_MODES:
+        raise ValueError(f"Unknown preview mode {mode!r}, expected one of {PREVIEW_MODES}")
+    if shape is None:
+        shape = encoded.shape
+    height, width = shape
+    thumb_height, thumb_width = min(thumb_shape[0], height), min(thumb_shape[1], width)
+    row_edges, col_edges = _tile_edges(height, thumb_height), _tile_edges(width, thumb_width)
+    coverage = tile_coverage(encoded, row_edges, col_edges, shape)
+    if mode == 'max':
+        return (coverage > 0).astype(np.float32)
+    return (coverage / np.outer(np.diff(row_edges), np.diff(col_edges))).astype(np.float32)
+
+def save_preview(image, path, title=None, dpi=100):
+    """
+    Write a thumbnail to a PNG file, one image pixel per output pixel.
+
+    The figure is built with matplotlib's object-oriented API rather than pyplot, so it is
+    never registered with pyplot, needs no GUI backend and is freed as soon as it is saved.
+
+    Parameters:
+    - image (numpy.ndarray): The thumbnail, with values in [0, 1].
+    - path (str): The PNG file to write. Missing directories are created.
+    - title (str, optional): A title drawn above the image. Defaults to None.
+    - dpi (int, optional): The resolution of the figure. Defaults to 100.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    title_height = 0.3 if title else 0.0
+    figure = Figure(figsize=(image.shape[1] / dpi, image.shape[0] / dpi + title_height), dpi=dpi)
+    FigureCanvasAgg(figure)
+    axes = figure.add_axes((0, 0, 1, image.shape[0] / (image.shape[0] + title_height * dpi)))
+    axes.imshow(image, cmap='gray', vmin=0, vmax=1, interpolation='nearest')
+    axes.axis('off')
+    if title:
+        figure.suptitle(title, y=1 - 0.5 * title_height * dpi / (image.shape[0] + title_height * dpi),
+                        va='center', fontsize=10)
+    figure.savefig(path, dpi=dpi)
+    figure.clear()
+
+def render_preview(encoded, path, thumb_shape=(512, 512), shape=None, mode='mean', title=None):
+    """
+    Build the thumbnail of an encoded image and write it to a PNG file.
+
+    Parameters:
+    - encoded (numpy.ndarray or EncodedImage): The encoded image, see `thumbnail`.
+    - path (str): The PNG file to write.
+    - thumb_shape (tuple, optional): The (height, width) of the thumbnail. Defaults to
+      (512, 512).
+    - shape (tuple, optional): The (height, width) of the image, see `thumbnail`.
+    - mode (str, optional): 'mean' or 'max', see `thumbnail`. Defaults to 'mean'.
+    - title (str, optional): A title drawn above the image. Defaults to None.
+
+    Returns:
+    - str: The path written.
+    """
+    save_preview(thumbnail(encoded, thumb_shape, shape, mode), path, title)
+    return path
+
+class PreviewWriter:
+    """
+    Render previews on a background thread pool so that writing PNGs never blocks the
+    caller. Use as a context manager, or call `close` to wait for the pending previews.
+    """
+
+    def __init__(self, workers=1):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='preview')
+        self.futures = []
+
+    def submit(self, encoded, path, thumb_shape=(512, 512), shape=None, mode='mean', title=None):
+        """
+        Queue `render_preview` for an encoded image and return its Future. The encoded
+        arrays must not be modified until the preview is written.
+        """
+        future = self.executor.submit(render_preview, encoded, path, thumb_shape, shape, mode, title)
+        self.futures.append(future)
+        return future
+
+    def close(self):
+        """
+        Wait for every queued preview and shut the pool down.
+
+        Returns:
+        - list of str: The paths written. The first failed preview's exception is raised.
+        """
+        self.executor.shutdown(wait=True)
+        futures, self.futures = self.futures, []
+        return [future.result() for future in futures]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.executor.shutdown(wait=True)
+        return False
@@ -0,0 +1,192 @@
+import numpy as np
+from src.optimized_encoding import EncodedImage
+from src.optimized_decoding import _fill_runs
+from src.optimized_preview import _CHUNK_ELEMENTS, _blob_rows, _pixel_chunks
+from src.storage import load_encoded, save_encoded
+
+# The coarsest level kept by default: 1/1024 scale
+MAX_LEVEL = 10
+
+def _level_name(level):
+    return f'level{level}'
+
+def _interval_level1(rows, starts, ends, level1):
+    """
+    Count the pixels of per-row intervals in every 2x2 tile.
+
+    Within a row of tiles, the pixels of an interval [s, e) per tile column form a step
+    function that rises by 1 at columns s // 2 and (s + 1) // 2 and falls by 1 at e // 2 and
+    (e + 1) // 2. Every row's steps sum to zero, so the counts of the whole level, read in
+    row-major order, are one step function whose breakpoints are the intervals' edges. Its
+    constant runs are written with the decoders' run filler, so the cost is the intervals
+    plus one bounded-chunk pass over the level, with no per-tile arithmetic.
+    """
+    row_offsets = (rows // 2) * level1.shape[1]
+    positions = np.concatenate((row_offsets + starts // 2, row_offsets + (starts + 1) // 2,
+                                row_offsets + ends // 2, row_offsets + (ends + 1) // 2))
+    steps = np.repeat(np.array([1, 1, -1, -1]), starts.size)
+    breaks, slots = np.unique(positions, return_inverse=True)
+    # The count before the first breakpoint is 0, and after each one the sum of the steps so far
+    values = np.concatenate(([0], np.cumsum(np.bincount(slots, weights=steps, minlength=breaks.size))))
+    _fill_runs(level1.reshape(-1), np.append(breaks, level1.size), values.astype(np.uint8))
+
+def _point_level1(encoded, shape, level1):
+    """
+    Count the set pixels of a point encoding in every 2x2 tile.
+
+    The encoders list pixels in row-major order, so the pixels of a band of tile rows are
+    contiguous and are counted with one `np.bincount` over the band's tiles, which is much
+    faster than scattered increments and bounds the counts to the band. Pixels out of
+    row order are counted with `np.add.at` instead.
+    """
+    flat = level1.reshape(-1)
+    tiles_wide = level1.shape[1]
+    band_tiles = max(1, _CHUNK_ELEMENTS // 8 // tiles_wide)
+    for rows, cols in _pixel_chunks(encoded, shape):
+        if rows.size == 0:
+            continue
+        tile_rows = rows // 2
+        tiles = tile_rows * tiles_wide + cols // 2
+        if np.any(tile_rows[1:] < tile_rows[:-1]):
+            np.add.at(flat, tiles, 1)
+            continue
+        for band_start in range(int(tile_rows[0]), int(tile_rows[-1]) + 1, band_tiles):
+            first, last = np.searchsorted(tile_rows, (band_start, band_start + band_tiles))
+            offset = band_start * tiles_wide
+            counts = np.bincount(tiles[first:last] - offset)
+            flat[offset:offset + counts.size] += counts.astype(np.uint8)
+
+def _level1(encoded, shape):
+    """
+    Count the set pixels of an encoded image in every 2x2 tile, straight into a uint8 array
+    at half resolution, so nothing larger than one band is allocated besides the level.
+    """
+    level1 = np.empty(((shape[0] + 1) // 2, (shape[1] + 1) // 2), dtype=np.uint8)
+    blob_rows = _blob_rows(encoded, shape)
+    if blob_rows is not None:
+        _interval_level1(*blob_rows, level1)
+        return level1
+    level1.fill(0)
+    _point_level1(encoded, shape, level1)
+    return level1
+
+def _downsample(counts, level):
+    """
+    Sum the 2x2 blocks of a level's counts to get the next level, odd edges counting only
+    the cells they have, in the smallest unsigned dtype that holds 4**level. The four
+    strided views of the level are added into the result, so no padded copy is made.
+    """
+    height, width = counts.shape
+    summed = np.zeros(((height + 1) // 2, (width + 1) // 2), dtype=np.min_scalar_type(4**level))
+    for row_offset in (0, 1):
+        for col_offset in (0, 1):
+            block = counts[row_offset::2, col_offset::2]
+            summed[:block.shape[0], :block.shape[1]] += block
+    return summed
+
+def build_pyramid(encoded, shape=None, max_level=MAX_LEVEL):
+    """
+    Build a multi-resolution pyramid of pixel counts from an encoded image.
+
+    Level k holds, for every 2**k x 2**k tile of the image, the number of set pixels in it;
+    tiles on the bottom and right edges may be cut short by the image border. Level 1 is
+    counted directly from the encoding into a uint8 array, from the edges of blob intervals
+    or by band of dye pixels, and every further level is the sum of 2x2 blocks of the one
+    before, so no level needs the full-resolution image. Counts rather than fractions are
+    stored so that each level is exact.
+
+    Parameters:
+    - encoded (numpy.ndarray or EncodedImage): A blob or dye encoding accepted by
+      `optimized_preview.thumbnail`.
+    - shape (tuple, optional): The (height, width) of the image. Defaults to None, meaning
+      the shape of `encoded`, which must then be an EncodedImage.
+    - max_level (int, optional): The coarsest level to build. Levels stop earlier once a
+      level is a single tile. Defaults to MAX_LEVEL (1/1024 scale).
+
+    Returns:
+    - EncodedImage: The pyramid in the 'pyramid' format, with the image's shape and one
+      array per level named 'level1', 'level2', ...
+    """
+    if shape is None:
+        shape = encoded.shape
+    counts = _level1(encoded, shape)
+    levels = {_level_name(1): counts}
+    for level in range(2, max_level + 1):
+        if counts.shape == (1, 1):
+            break
+        counts = _downsample(counts, level)
+        levels[_level_name(level)] = counts
+    return EncodedImage('pyramid', tuple(shape), levels)
+
+def pyramid_levels(pyramid):
+    """
+    Return the number of levels of a pyramid from `build_pyramid`.
+    """
+    return len(pyramid.arrays)
+
+def pyramid_counts(pyramid, level, row_start=0, row_stop=None, col_start=0, col_stop=None):
+    """
+    Look up the pixel counts of a region of one pyramid level.
+
+    Parameters:
+    - pyramid (EncodedImage): A pyramid from `build_pyramid` or `load_pyramid`.
+    - level (int): The level, from 1 (1/2 scale) to `pyramid_levels(pyramid)`.
+    - row_start (int, optional): The first tile row of the region, in level coordinates.
+      Defaults to 0.
+    - row_stop (int, optional): The tile row after the region. Defaults to None, meaning the
+      last row of the level.
+    - col_start (int, optional): The first tile column of the region. Defaults to 0.
+    - col_stop (int, optional): The tile column after the region. Defaults to None, meaning
+      the last column of the level.
+
+    Returns:
+    - numpy.ndarray: The number of set pixels in every tile of the region.
+    """
+    if not 1 <= level <= pyramid_levels(pyramid):
+        raise ValueError(f"level must be between 1 and {pyramid_levels(pyramid)}, got {level}")
+    return pyramid.arrays[_level_name(level)][row_start:row_stop, col_start:col_stop]
+
+def pyramid_region(pyramid, level, row_start=0, row_stop=None, col_start=0, col_stop=None):
+    """
+    Look up the coverage fractions of a region of one pyramid level.
+
+    Parameters:
+    - pyramid (EncodedImage): A pyramid from `build_pyramid` or `load_pyramid`.
+    - level (int): The level, from 1 (1/2 scale) to `pyramid_levels(pyramid)`.
+    - row_start, row_stop, col_start, col_stop (int, optional): The region in level
+      coordinates, see `pyramid_counts`. Defaults to the whole level.
+
+    Returns:
+    - numpy.ndarray: A float32 array with the fraction of set pixels in every tile of the
+      region, each tile's area clipped to the image border.
+    """
+    counts = pyramid_counts(pyramid, level, row_start, row_stop, col_start, col_stop)
+    tile = 2**level
+    level_height, level_width = pyramid.arrays[_level_name(level)].shape
+    rows = np.arange(level_height)[row_start:row_stop]
+    cols = np.arange(level_width)[col_start:col_stop]
+    heights = np.minimum((rows + 1) * tile, pyramid.shape[0]) - rows * tile
+    widths = np.minimum((cols + 1) * tile, pyramid.shape[1]) - cols * tile
+    return (counts / np.outer(heights, widths)).astype(np.float32)
+
+def save_pyramid(path, pyramid):
+    """
+    Save a pyramid to a binary container file, see `storage.save_encoded`.
+
+    Returns:
+    - int: The number of bytes written.
+    """
+    return save_encoded(path, pyramid.format, pyramid.shape, pyramid.arrays)
+
+def load_pyramid(path, mmap=True, verify=False):
+    """
+    Load a pyramid saved by `save_pyramid`. With `mmap` and without `verify`, only the tiles
+    that are looked up are read from disk.
+
+    Returns:
+    - EncodedImage: The pyramid in the 'pyramid' format.
+    """
+    kind, shape, arrays = load_encoded(path, mmap=mmap, verify=verify)
+    if kind != 'pyramid':
+        raise ValueError(f"{path} holds a {kind!r} encoding, not a pyramid")
+    return EncodedImage(kind, shape, arrays)
@@ -0,0 +1,148 @@
+import numpy as np
+from src.optimized_encoding import row_numbers, rows_band
+
+def _segment_lower_bound(values, lo, hi, target):
+    """
+    Binary-search many sorted segments of one array at once.
+
+    Parameters:
+    - values (numpy.ndarray): The array holding the segments, each sorted ascending.
+    - lo (numpy.ndarray): The start offset of each segment.
+    - hi (numpy.ndarray): The exclusive end offset of each segment.
+    - target (int): The value to search for.
+
+    Returns:
+    - numpy.ndarray: For each segment, the first offset in [lo, hi) whose value is not less
+      than `target`, or `hi` if there is none.
+    """
+    lo, hi = lo.astype(np.int64), hi.astype(np.int64)
+    last = max(values.size - 1, 0)
+    active = lo < hi
+    while np.any(active):
+        mid = (lo + hi) // 2
+        go_right = active & (values[np.minimum(mid, last)] < target)
+        lo = np.where(go_right, mid + 1, lo)
+        hi = np.where(active & ~go_right, mid, hi)
+        active = lo < hi
+    return lo
+
+def _row_pointers(csr, row_start, row_stop):
+    """
+    Clamp a row range to the image and return its slice of the row-pointer array as int64.
+    """
+    height = csr.shape[0]
+    row_start, row_stop = max(0, min(row_start, height)), max(0, min(row_stop, height))
+    row_stop = max(row_start, row_stop)
+    return row_start, csr.arrays['indptr'][row_start:row_stop + 1].astype(np.int64)
+
+def csr_count_rows(csr, row_start, row_stop):
+    """
+    Count the dyed pixels in rows `row_start <= r < row_stop` of a 'csr' encoded image.
+
+    Parameters:
+    - csr (EncodedImage): A dye distribution from `encode_sparse_csr_optimized`.
+    - row_start (int): The first row of the band.
+    - row_stop (int): The row after the last row of the band.
+
+    Returns:
+    - int: The number of dyed pixels in the band, read from the row pointers in O(1).
+    """
+    _, indptr = _row_pointers(csr, row_start, row_stop)
+    return int(indptr[-1] - indptr[0])
+
+def csr_row_band(csr, row_start, row_stop):
+    """
+    Extract the dyed pixels in rows `row_start <= r < row_stop` of a 'csr' encoded image.
+
+    Parameters:
+    - csr (EncodedImage): A dye distribution from `encode_sparse_csr_optimized`.
+    - row_start (int): The first row of the band.
+    - row_stop (int): The row after the last row of the band.
+
+    Returns:
+    - tuple of numpy.ndarray: `(rows, cols)` of every dyed pixel in the band, in row-major
+      order. The cost is proportional to the number of rows and pixels returned.
+    """
+    row_start, indptr = _row_pointers(csr, row_start, row_stop)
+    rows = row_numbers(indptr, row_start)
+    return rows, csr.arrays['indices'][indptr[0]:indptr[-1]].astype(np.int64)
+
+def _region_bounds(csr, row_start, row_stop, col_start, col_stop):
+    """
+    Return the first row of a region and, for each of its rows, the [lo, hi) range of
+    `indices` whose columns lie in `col_start <= c < col_stop`.
+    """
+    row_start, indptr = _row_pointers(csr, row_start, row_stop)
+    indices = csr.arrays['indices']
+    lo = _segment_lower_bound(indices, indptr[:-1], indptr[1:], col_start)
+    hi = _segment_lower_bound(indices, lo, indptr[1:], col_stop)
+    return row_start, lo, hi
+
+def csr_count_region(csr, row_start, row_stop, col_start, col_stop):
+    """
+    Count the dyed pixels in the rectangle `row_start <= r < row_stop`,
+    `col_start <= c < col_stop` of a 'csr' encoded image.
+
+    Each row of the rectangle is binary-searched for its column bounds, all rows at once,
+    so the cost is O(rows * log(row length)) no matter how many pixels the image holds.
+
+    Parameters:
+    - csr (EncodedImage): A dye distribution from `encode_sparse_csr_optimized`.
+    - row_start (int): The first row of the region.
+    - row_stop (int): The row after the last row of the region.
+    - col_start (int): The first column of the region.
+    - col_stop (int): The column after the last column of the region.
+
+    Returns:
+    - int: The number of dyed pixels in the region.
+    """
+    _, lo, hi = _region_bounds(csr, row_start, row_stop, col_start, col_stop)
+    return int(np.sum(hi - lo))
+
+def csr_region(csr, row_start, row_stop, col_start, col_stop):
+    """
+    Extract the dyed pixels in the rectangle `row_start <= r < row_stop`,
+    `col_start <= c < col_stop` of a 'csr' encoded image.
+
+    Parameters:
+    - csr (EncodedImage): A dye distribution from `encode_sparse_csr_optimized`.
+    - row_start (int): The first row of the region.
+    - row_stop (int): The row after the last row of the region.
+    - col_start (int): The first column of the region.
+    - col_stop (int): The column after the last column of the region.
+
+    Returns:
+    - tuple of numpy.ndarray: `(rows, cols)` of every dyed pixel in the region, in row-major
+      order. The cost is proportional to the rows searched plus the pixels returned.
+    """
+    row_start, lo, hi = _region_bounds(csr, row_start, row_stop, col_start, col_stop)
+    counts = hi - lo
+    rows = np.repeat(np.arange(row_start, row_start + counts.size), counts)
+    # Offsets of every selected entry: lo of its row plus its rank within the row
+    offsets = np.repeat(lo - (np.cumsum(counts) - counts), counts) + np.arange(rows.size)
+    return rows, csr.arrays['indices'][offsets].astype(np.int64)
+
+def blob_area_in_region(rows_encoded, row_start, row_stop, col_start=0, col_stop=None):
+    """
+    Measure the blob area inside the rectangle `row_start <= r < row_stop`,
+    `col_start <= c < col_stop` of a row-indexed RLE ('rle_rows') encoding.
+
+    The band's intervals are located through the row pointers and clipped to the column
+    range, so the cost is proportional to the number of intervals in the band.
+
+    Parameters:
+    - rows_encoded (EncodedImage): A blob in the 'rle_rows' format, see `rle_to_rows`.
+    - row_start (int): The first row of the region.
+    - row_stop (int): The row after the last row of the region.
+    - col_start (int, optional): The first column of the region. Defaults to 0.
+    - col_stop (int, optional): The column after the last column of the region. Defaults
+      to None, meaning the full width.
+
+    Returns:
+    - int: The number of blob pixels in the region.
+    """
+    col_stop = rows_encoded.shape[1] if col_stop is None else col_stop
+    band = rows_band(rows_encoded, row_start, row_stop)
+    starts = np.maximum(band.arrays['starts'].astype(np.int64), col_start)
+    ends = np.minimum(band.arrays['ends'].astype(np.int64), col_stop)
+    return int(np.sum(np.maximum(ends - starts, 0)))
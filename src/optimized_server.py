@@ -0,0 +1,388 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+from src.optimized_encoding import EncodedImage
+from src.optimized_cancerDetection import score_encoded
+from src.storage import dumps, loads
+
+DEFAULT_PORT = 8765
+MAX_BATCH = 16
+# How long a batch waits for more requests once its first one has arrived
+MAX_DELAY = 0.002
+QUEUE_SIZE = 256
+MAX_PAYLOAD_BYTES = 2**30
+
+# Length of the microscope container at the start of a request body
+_PREFIX = struct.Struct('<Q')
+
+# Encodings `score_encoded` accepts for each image of a request
+_BLOB_FORMATS = ('rle', 'rle_rows', 'contour')
+_DYE_FORMATS = ('sparse', 'coo', 'csr', 'packed', 'rle')
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+            413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+def pack_request(microscope, dye):
+    """
+    Build the body of a scoring request.
+
+    The body is the byte length of the microscope container as a little-endian uint64,
+    then the microscope and dye binary containers of `storage.dumps`, so each image keeps
+    its own encoding kind, shape and checksum.
+
+    Parameters:
+    - microscope (EncodedImage): The microscope image, in any format of `blob_intervals`.
+    - dye (EncodedImage): The dye distribution, in any format of `count_dye_in_blob`.
+
+    Returns:
+    - bytes: The request body.
+    """
+    microscope_bytes = dumps(microscope.format, microscope.shape, microscope.arrays)
+    return _PREFIX.pack(len(microscope_bytes)) + microscope_bytes + dumps(dye.format, dye.shape, dye.arrays)
+
+def _array(image, name, ndim=1, columns=None):
+    """
+    Return the array `name` of an image from a request, checking that it is an integer
+    array with `ndim` dimensions and, for 2D arrays, `columns` columns.
+    """
+    if name not in image.arrays:
+        raise ValueError(f"{image.format} image has no {name!r} array")
+    array = image.arrays[name]
+    if (not np.issubdtype(array.dtype, np.integer) or array.ndim != ndim
+            or (columns is not None and array.shape[1] != columns)):
+        expected = f"({columns} columns) " if columns is not None else ''
+        raise ValueError(f"{name!r} of a {image.format} image must be a {ndim}D {expected}integer array, "
+                         f"got {array.dtype} with shape {array.shape}")
+    return array
+
+def _check_range(array, name, low, high):
+    if array.size and (int(array.min()) < low or int(array.max()) > high):
+        raise ValueError(f"{name!r} has values outside [{low}, {high}]")
+
+def _check_offsets(offsets, name, rows, total):
+    """
+    Check that `offsets` are the row offsets of `rows` rows into `total` entries.
+    """
+    if offsets.size != rows + 1:
+        raise ValueError(f"{name!r} must have {rows + 1} entries, got {offsets.size}")
+    if int(offsets[0]) != 0 or int(offsets[-1]) != total or np.any(np.diff(offsets.astype(np.int64)) < 0):
+        raise ValueError(f"{name!r} must rise from 0 to {total}")
+
+def _check_image(image):
+    """
+    Check that the arrays of a request image are consistent with its format and shape, so
+    that a malformed request is rejected before it reaches a worker.
+
+    Raises:
+    - ValueError: If an array is missing, has the wrong dtype or dimensions, or holds
+      lengths or coordinates that do not fit the image.
+    """
+    height, width = image.shape
+    if height * width > 2**62:
+        raise ValueError(f"image of {height}x{width} pixels is too large")
+    if image.format == 'rle':
+        rle = _array(image, 'rle')
+        if rle.size % 2:
+            raise ValueError("'rle' must hold (value, length) pairs")
+        _check_range(rle[1::2], 'rle', 0, height * width)
+        if int(np.sum(rle[1::2], dtype=np.uint64)) != height * width:
+            raise ValueError(f"'rle' run lengths must add up to {height * width} pixels")
+    elif image.format == 'rle_rows':
+        starts, ends = _array(image, 'starts'), _array(image, 'ends')
+        if starts.size != ends.size:
+            raise ValueError("'starts' and 'ends' must have the same length")
+        _check_offsets(_array(image, 'row_ptr'), 'row_ptr', height, starts.size)
+        _check_range(starts, 'starts', 0, width)
+        _check_range(ends, 'ends', 0, width)
+        if np.any(starts > ends):
+            raise ValueError("'starts' must not exceed 'ends'")
+    elif image.format == 'contour':
+        origin = _array(image, 'origin')
+        if origin.size != 4:
+            raise ValueError(f"'origin' must have 4 entries, got {origin.size}")
+        first_row, rows, left, right = (int(value) for value in origin)
+        if first_row < 0 or rows < 0 or first_row + rows > height:
+            raise ValueError(f"contour rows {first_row} to {first_row + rows} do not fit {height} rows")
+        for name, first in (('left', left), ('right', right)):
+            runs = _array(image, name, 2, 2)
+            _check_range(runs[:, 1], name, 0, height)
+            if int(np.sum(runs[:, 1], dtype=np.int64)) != max(rows - 1, 0):
+                raise ValueError(f"{name!r} must step over {max(rows - 1, 0)} rows")
+            # An edge is straight along each run, so its extremes lie at the run boundaries
+            columns = first + np.cumsum(runs[:, 0].astype(np.int64) * runs[:, 1])
+            _check_range(np.append(columns, first), name, 0, width)
+    elif image.format == 'sparse':
+        sparse = _array(image, 'sparse', 2, 3)
+        _check_range(sparse[:, 0], 'sparse', 0, height - 1)
+        _check_range(sparse[:, 1], 'sparse', 0, width - 1)
+    elif image.format == 'coo':
+        rows, cols = _array(image, 'rows'), _array(image, 'cols')
+        if rows.size != cols.size:
+            raise ValueError("'rows' and 'cols' must have the same length")
+        _check_range(rows, 'rows', 0, height - 1)
+        _check_range(cols, 'cols', 0, width - 1)
+    elif image.format == 'csr':
+        indices = _array(image, 'indices')
+        _check_offsets(_array(image, 'indptr'), 'indptr', height, indices.size)
+        _check_range(indices, 'indices', 0, width - 1)
+    elif image.format == 'packed':
+        bits = _array(image, 'bits')
+        if bits.dtype != np.uint8 or bits.size != -(-height * width // 8):
+            raise ValueError(f"'bits' must be {-(-height * width // 8)} uint8 bytes, "
+                             f"got {bits.size} of {bits.dtype}")
+
+def unpack_request(body):
+    """
+    Split a request body from `pack_request` into its two images, as views of `body`.
+
+    Returns:
+    - tuple of EncodedImage: `(microscope, dye)`.
+
+    Raises:
+    - ValueError: If the body is malformed, fails a checksum, or holds images in formats
+      that cannot be scored or whose arrays do not match their format and shape.
+    """
+    body = memoryview(body)
+    if len(body) < _PREFIX.size:
+        raise ValueError("request body is too short")
+    (split,) = _PREFIX.unpack_from(body)
+    if split > len(body) - _PREFIX.size:
+        raise ValueError("microscope length exceeds the request body")
+    microscope = EncodedImage(*loads(body[_PREFIX.size:_PREFIX.size + split]))
+    dye = EncodedImage(*loads(body[_PREFIX.size + split:]))
+    if microscope.format not in _BLOB_FORMATS:
+        raise ValueError(f"microscope format must be one of {_BLOB_FORMATS}, got {microscope.format!r}")
+    if dye.format not in _DYE_FORMATS:
+        raise ValueError(f"dye format must be one of {_DYE_FORMATS}, got {dye.format!r}")
+    if microscope.shape != dye.shape:
+        raise ValueError(f"microscope shape {microscope.shape} differs from dye shape {dye.shape}")
+    _check_image(microscope)
+    _check_image(dye)
+    return microscope, dye
+
+def score_request(body):
+    """
+    Score one request body: the counts and verdicts of `score_encoded`, plus 'dye_fraction',
+    the share of the blob covered by dye (0.0 for an empty blob).
+    """
+    return _score_images(*unpack_request(body))
+
+def _score_images(microscope, dye):
+    result = score_encoded(dye, microscope, microscope.shape)
+    result['dye_fraction'] = result['dye_in_blob'] / result['blob_area'] if result['blob_area'] else 0.0
+    return result
+
+def _score_batch(bodies):
+    """
+    Score a batch of request bodies in a worker. A failed request yields a `(status,
+    message)` tuple in place of its result, so it does not fail the rest of its batch: 400
+    for a body `unpack_request` rejects, 500 for a failure while scoring a valid one.
+    """
+    results = []
+    for body in bodies:
+        try:
+            images = unpack_request(body)
+        except ValueError as exc:
+            results.append((400, str(exc)))
+            continue
+        try:
+            results.append(_score_images(*images))
+        except Exception as exc:
+            results.append((500, repr(exc)))
+    return results
+
+class ScoringServer:
+    """
+    Score encoded microscope/dye pairs sent over HTTP/1.1, on a TCP or a Unix socket.
+
+    `POST /score` takes a body from `pack_request` and answers with the JSON of
+    `score_request`, or with an 'error' message: a 400 for a body `unpack_request` rejects,
+    a 500 if scoring or the worker pool fails. `GET /stats` reports the request,
+    batch and queue counters. Connections are kept alive between requests.
+
+    Requests are put on a bounded queue. One batcher per worker takes the first waiting
+    request, gives others up to `max_delay` seconds to arrive, and sends up to `max_batch`
+    of them to the worker pool in one call, so the cost of handing work to a process is
+    paid per batch rather than per request. At most one batch per worker is in flight;
+    once the queue is full, connections wait to enqueue and stop reading, which pushes
+    back on the clients.
+
+    Parameters:
+    - workers (int, optional): The number of workers. Defaults to None, meaning
+      `os.cpu_count()`.
+    - threads (bool, optional): If True, score on a thread pool instead of a process pool.
+      This avoids copying payloads between processes and suits small images, but scoring
+      then shares the interpreter lock with the server. Defaults to False.
+    - max_batch (int, optional): The largest number of requests scored in one call.
+      Defaults to MAX_BATCH.
+    - max_delay (float, optional): The time in seconds a batch waits to fill up. Defaults
+      to MAX_DELAY (2 ms).
+    - queue_size (int, optional): The number of requests waiting for a batcher before
+      connections are made to wait. Defaults to QUEUE_SIZE.
+    - max_payload (int, optional): The largest request body accepted, in bytes. Defaults to
+      MAX_PAYLOAD_BYTES (1 GiB).
+    """
+
+    def __init__(self, workers=None, threads=False, max_batch=MAX_BATCH, max_delay=MAX_DELAY,
+                 queue_size=QUEUE_SIZE, max_payload=MAX_PAYLOAD_BYTES):
+        self.workers = workers or os.cpu_count()
+        self.threads = threads
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue_size = queue_size
+        self.max_payload = max_payload
+        self.counters = {'requests': 0, 'errors': 0, 'batches': 0, 'batched_requests': 0}
+
+    async def _batcher(self, executor):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            if self.max_delay > 0 and self.queue.qsize() < self.max_batch - 1:
+                await asyncio.sleep(self.max_delay)
+            while len(batch) < self.max_batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            self.counters['batches'] += 1
+            self.counters['batched_requests'] += len(batch)
+            try:
+                results = await loop.run_in_executor(executor, _score_batch, [body for body, _ in batch])
+            except Exception as exc:
+                # The worker itself failed, for example a process of the pool died
+                results = [(500, repr(exc))] * len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def score(self, body):
+        """
+        Queue a request body for scoring and wait for its result.
+
+        Returns:
+        - dict or tuple: The result of `score_request`, or the `(status, message)` of a
+          failure.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((body, future))
+        return await future
+
+    def stats(self):
+        """
+        Return the server counters: 'requests', 'errors', 'batches', 'mean_batch' and 'queued'.
+        """
+        batches = self.counters['batches']
+        return dict(self.counters, mean_batch=self.counters['batched_requests'] / batches if batches else 0.0,
+                    queued=self.queue.qsize())
+
+    async def _respond(self, method, path, body):
+        if path == '/stats':
+            return 200, self.stats()
+        if path != '/score':
+            return 404, {'error': f"unknown path {path}"}
+        if method != 'POST':
+            return 405, {'error': "use POST /score"}
+        self.counters['requests'] += 1
+        result = await self.score(body)
+        if isinstance(result, tuple):
+            self.counters['errors'] += 1
+            status, message = result
+            return status, {'error': message}
+        return 200, result
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                if length > self.max_payload:
+                    status, result, keep_alive = 413, {'error': f"body larger than {self.max_payload} bytes"}, False
+                else:
+                    body = await reader.readexactly(length)
+                    status, result = await self._respond(method, path, body)
+                payload = json.dumps(result).encode()
+                writer.write(f"HTTP/1.1 {status} {_REASONS[status]}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(payload)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1')
+                             + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            # A client that disconnects or sends a malformed request only loses its connection
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=DEFAULT_PORT, unix_path=None, ready=None):
+        """
+        Run the server until it is cancelled.
+
+        Parameters:
+        - host (str, optional): The TCP address to listen on. Defaults to '127.0.0.1'.
+        - port (int, optional): The TCP port. Defaults to DEFAULT_PORT.
+        - unix_path (str, optional): Listen on this Unix socket instead of TCP. Defaults to
+          None.
+        - ready (callable, optional): Called with the listening asyncio Server once requests
+          are accepted. Defaults to None.
+        """
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        pool = ThreadPoolExecutor if self.threads else ProcessPoolExecutor
+        with pool(max_workers=self.workers) as executor:
+            batchers = [asyncio.create_task(self._batcher(executor)) for _ in range(self.workers)]
+            if unix_path is not None:
+                server = await asyncio.start_unix_server(self._handle, path=unix_path)
+            else:
+                server = await asyncio.start_server(self._handle, host, port)
+            try:
+                async with server:
+                    if ready is not None:
+                        ready(server)
+                    await server.serve_forever()
+            finally:
+                for batcher in batchers:
+                    batcher.cancel()
+                await asyncio.gather(*batchers, return_exceptions=True)
+
+async def _serve_until_terminated(server, *args, **kwargs):
+    # Stop on SIGTERM as on Ctrl-C, by cancelling `serve`, so the worker pool is shut down
+    # instead of being left running without its parent
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    await server.serve(*args, **kwargs)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve cancer detection on encoded images over HTTP.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix', metavar='PATH', help="listen on a Unix socket instead of TCP")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--threads', action='store_true', help="score on threads instead of processes")
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH)
+    parser.add_argument('--max-delay-ms', type=float, default=MAX_DELAY * 1e3)
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE)
+    parser.add_argument('--max-payload', type=int, default=MAX_PAYLOAD_BYTES, metavar='BYTES',
+                        help="largest request body accepted")
+    args = parser.parse_args()
+    server = ScoringServer(args.workers, args.threads, args.max_batch, args.max_delay_ms / 1e3, args.queue_size,
+                           args.max_payload)
+    address = args.unix or f"http://{args.host}:{args.port}"
+    started = time.perf_counter()
+    try:
+        asyncio.run(_serve_until_terminated(server, args.host, args.port, args.unix,
+                                            ready=lambda _: print(f"Listening on {address}", flush=True)))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        print(f"Stopped after {time.perf_counter() - started:.1f} s: {server.stats()}")
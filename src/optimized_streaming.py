@@ -0,0 +1,178 @@
+import numpy as np
+from src.optimized_encoding import _csr_from_coordinates, _pack_runs, _run_boundaries
+
+def _as_rows(rows, width):
+    """
+    View a fed chunk as a 2D array of whole rows, accepting a single 1D scanline.
+    """
+    rows = np.asarray(rows)
+    if rows.ndim == 1:
+        rows = rows[None, :]
+    if rows.ndim != 2 or rows.shape[1] != width:
+        raise ValueError(f"expected rows of width {width}, got an array of shape {rows.shape}")
+    return rows
+
+class StreamingRLEEncoder:
+    """
+    Encode an image into the RLE format of `encode_rle_optimized` while its rows arrive.
+
+    Each `feed` finds the runs of the new rows and merges the first of them into the run
+    left open by the previous rows, so runs spanning row or chunk boundaries come out whole.
+    Every run except the last one is then complete: it is packed into the output dtype
+    (splitting runs longer than the dtype allows, exactly as the batch encoder does) and
+    either kept or handed to `sink`. Only the open run is carried between calls, so with a
+    sink the memory used does not grow with the height of the image.
+
+    Example, writing the encoding to disk as it is produced:
+
+        with open('microscope.rle', 'wb') as f:
+            encoder = StreamingRLEEncoder(width, sink=lambda segment: f.write(segment.tobytes()))
+            for rows in scanner:
+                encoder.feed(rows)
+            encoder.finish()
+
+    `np.fromfile('microscope.rle', dtype=np.uint16)` then equals `encode_rle_optimized`
+    of the whole image.
+
+    Parameters:
+    - width (int): The width of the image.
+    - run_dtype (numpy.dtype, optional): The unsigned integer dtype of the output, see
+      `encode_rle_optimized`. Defaults to np.uint16.
+    - sink (callable, optional): Called with every packed segment of completed runs, a 1D
+      array of alternating values and lengths. Defaults to None, meaning the segments are
+      kept and returned by `finish`.
+    """
+
+    def __init__(self, width, run_dtype=np.uint16, sink=None):
+        self.width = width
+        self.run_dtype = np.dtype(run_dtype)
+        self.sink = sink
+        self.rows = 0
+        self.segments = []
+        self.open_value = None
+        self.open_length = 0
+
+    def _emit(self, values, lengths):
+        if lengths.size == 0:
+            return
+        segment = _pack_runs(values, lengths, self.run_dtype)
+        if self.sink is not None:
+            self.sink(segment)
+        else:
+            self.segments.append(segment)
+
+    def feed(self, rows):
+        """
+        Encode the next rows of the image.
+
+        Parameters:
+        - rows (numpy.ndarray): A 2D array of whole rows, or a single 1D row.
+        """
+        rows = _as_rows(rows, self.width)
+        if rows.size == 0:
+            return
+        values, lengths = _run_boundaries(np.ravel(rows))
+        if self.open_value is not None:
+            if values[0] == self.open_value:
+                lengths[0] += self.open_length
+            else:
+                self._emit(np.array([self.open_value], dtype=values.dtype),
+                           np.array([self.open_length], dtype=np.int64))
+        self._emit(values[:-1], lengths[:-1])
+        self.open_value, self.open_length = values[-1], int(lengths[-1])
+        self.rows += rows.shape[0]
+
+    def finish(self):
+        """
+        Close the last run and end the image.
+
+        Returns:
+        - numpy.ndarray or None: The RLE of every row fed, identical to
+          `encode_rle_optimized(image, run_dtype)`, or None if the segments went to `sink`.
+        """
+        if self.open_value is not None:
+            self._emit(np.array([self.open_value]), np.array([self.open_length], dtype=np.int64))
+            self.open_value, self.open_length = None, 0
+        if self.sink is not None:
+            return None
+        segments, self.segments = self.segments, []
+        return np.concatenate(segments) if segments else np.zeros(0, dtype=self.run_dtype)
+
+    @property
+    def shape(self):
+        """
+        The (height, width) of the rows fed so far.
+        """
+        return (self.rows, self.width)
+
+class StreamingSparseEncoder:
+    """
+    Encode a dye distribution into the sparse formats while its rows arrive.
+
+    Each `feed` lists the dyed pixels of the new rows, offsetting their row indices by the
+    rows already fed, so the entries come out in the same row-major order as the batch
+    encoders produce them.
+
+    Parameters:
+    - width (int): The width of the image.
+    - sink (callable, optional): Called with the (n, 3) int64 array of (row, column, value)
+      entries of every fed chunk that holds dye. Defaults to None, meaning the entries are
+      kept and returned by `finish`.
+    """
+
+    def __init__(self, width, sink=None):
+        self.width = width
+        self.sink = sink
+        self.rows = 0
+        self.row_chunks = []
+        self.col_chunks = []
+
+    def feed(self, rows):
+        """
+        Encode the next rows of the dye distribution.
+
+        Parameters:
+        - rows (numpy.ndarray): A 2D array of whole rows, or a single 1D row.
+        """
+        rows = _as_rows(rows, self.width)
+        dyed_rows, dyed_cols = np.nonzero(rows)
+        dyed_rows = dyed_rows + self.rows
+        self.rows += rows.shape[0]
+        if dyed_rows.size == 0:
+            return
+        if self.sink is not None:
+            self.sink(np.column_stack((dyed_rows, dyed_cols, np.ones_like(dyed_rows))))
+        else:
+            self.row_chunks.append(dyed_rows)
+            self.col_chunks.append(dyed_cols)
+
+    def finish(self, format='sparse'):
+        """
+        End the image.
+
+        Parameters:
+        - format (str, optional): 'sparse' for the (n, 3) matrix of
+          `encode_sparse_matrix_optimized`, or 'csr' for the EncodedImage of
+          `encode_sparse_csr_optimized`. Defaults to 'sparse'.
+
+        Returns:
+        - numpy.ndarray or EncodedImage or None: The encoding of every row fed, identical to
+          the batch encoder's, or None if the entries went to `sink`.
+        """
+        if self.sink is not None:
+            return None
+        rows = np.concatenate(self.row_chunks) if self.row_chunks else np.zeros(0, dtype=np.intp)
+        cols = np.concatenate(self.col_chunks) if self.col_chunks else np.zeros(0, dtype=np.intp)
+        self.row_chunks, self.col_chunks = [], []
+        if format == 'csr':
+            return _csr_from_coordinates(rows, cols, self.shape)
+        if format != 'sparse':
+            raise ValueError(f"format must be 'sparse' or 'csr', got {format!r}")
+        return np.column_stack((rows, cols, np.ones_like(rows, dtype=np.uint8)))
+
+    @property
+    def shape(self):
+        """
+        The (height, width) of the rows fed so far.
+        """
+        return (self.rows, self.width)
@@ -1,8 +1,9 @@
 import os
-import matplotlib.pyplot as plt
 
 def visualize_image_optimized(image, title, output_dir=None, filename=None, show_image=True, save_image=False):
-    plt.figure(figsize=(10, 10))
+    # Imported here so that importing this module, and headless runs, never load matplotlib
+    import matplotlib.pyplot as plt
+    figure = plt.figure(figsize=(10, 10))
     plt.imshow(image, cmap='gray')
     plt.title(title)
     plt.axis('off')
@@ -17,3 +18,5 @@ def visualize_image_optimized(image, title, output_dir=None, filename=None, show
         print(f"Image saved at {file_path}")
     if show_image:
         plt.show()
+    # Release the figure; pyplot keeps every open figure alive until it is closed
+    plt.close(figure)
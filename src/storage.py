@@ -0,0 +1,210 @@
+import argparse
+import json
+import struct
+import zlib
+import numpy as np
+
+MAGIC = b'DFEI'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+# magic, version, array count, encoding kind, image height, image width, crc32 of the body
+_HEADER = struct.Struct('<4sHH16sQQI4x')
+# array name, dtype string, ndim, (padding), dim 0, dim 1, absolute byte offset
+_ARRAY_ENTRY = struct.Struct('<16s8sI4xQQQ')
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+def _smallest_uint(max_value):
+    """
+    Return the smallest unsigned integer dtype that can hold `max_value`.
+    """
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if max_value <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    raise ValueError(f"{max_value} does not fit in an unsigned 64-bit integer")
+
+def compact(array):
+    """
+    Return a non-negative integer array in the smallest unsigned dtype that holds its values.
+    """
+    array = np.asarray(array)
+    max_value = int(array.max()) if array.size else 0
+    return array.astype(_smallest_uint(max_value))
+
+def dumps(kind, shape, arrays):
+    """
+    Serialize an encoded image to the bytes of a binary container, see `save_encoded`.
+
+    Parameters:
+    - kind (str): The encoding kind, for example 'rle' or 'sparse' (at most 16 ASCII bytes).
+    - shape (tuple): The (height, width) of the encoded image.
+    - arrays (dict): Maps array names (at most 16 ASCII bytes) to 1D or 2D numpy arrays.
+
+    Returns:
+    - bytes: The container, identical to the contents of the file `save_encoded` writes.
+    """
+    arrays = {name: np.ascontiguousarray(array, dtype=np.asarray(array).dtype.newbyteorder('<'))
+              for name, array in arrays.items()}
+    for name, array in arrays.items():
+        if array.ndim not in (1, 2):
+            raise ValueError(f"array '{name}' must be 1D or 2D, got {array.ndim}D")
+
+    body = bytearray()
+    offset = _aligned(_HEADER.size + _ARRAY_ENTRY.size * len(arrays))
+    payload_offsets = []
+    for name, array in arrays.items():
+        dims = array.shape + (0,) * (2 - array.ndim)
+        body += _ARRAY_ENTRY.pack(name.encode('ascii'), array.dtype.str.encode('ascii'),
+                                  array.ndim, dims[0], dims[1], offset)
+        payload_offsets.append(offset)
+        offset = _aligned(offset + array.nbytes)
+    for array, payload_offset in zip(arrays.values(), payload_offsets):
+        body += bytes(payload_offset - _HEADER.size - len(body))
+        body += array.tobytes()
+
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, len(arrays), kind.encode('ascii'),
+                          shape[0], shape[1], zlib.crc32(body))
+    return header + body
+
+def save_encoded(path, kind, shape, arrays):
+    """
+    Save an encoded image to a versioned binary container.
+
+    The file starts with a fixed header holding the format version, the encoding kind, the
+    image shape and a CRC-32 of everything after the header. An array table follows with the
+    name, dtype, shape and offset of each array, and then the raw little-endian array data,
+    each array aligned to 64 bytes so that `load_encoded` can map it with `np.memmap`.
+
+    Parameters:
+    - path (str): The file to write.
+    - kind (str): The encoding kind, for example 'rle' or 'sparse' (at most 16 ASCII bytes).
+    - shape (tuple): The (height, width) of the encoded image.
+    - arrays (dict): Maps array names (at most 16 ASCII bytes) to 1D or 2D numpy arrays.
+
+    Returns:
+    - int: The number of bytes written.
+    """
+    data = dumps(kind, shape, arrays)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return len(data)
+
+def loads(data, verify=True):
+    """
+    Deserialize an encoded image from the bytes of a binary container, such as a payload
+    received over a socket.
+
+    Parameters:
+    - data (bytes-like): The container, as produced by `dumps` or read from a file written
+      by `save_encoded`.
+    - verify (bool, optional): If True, the CRC-32 stored in the header is checked. Defaults
+      to True.
+
+    Returns:
+    - tuple: `(kind, shape, arrays)`, see `load_encoded`.
+
+    Raises:
+    - ValueError: If `data` is not a valid container.
+
+    Note:
+    - The arrays are read-only views of `data`, not copies.
+    """
+    data = memoryview(data).cast('B')
+    if len(data) < _HEADER.size or bytes(data[:4]) != MAGIC:
+        raise ValueError("data is not an encoded image")
+    magic, version, n_arrays, kind, height, width, crc = _HEADER.unpack_from(data)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"data has format version {version}, expected {FORMAT_VERSION}")
+    if verify and zlib.crc32(data[_HEADER.size:]) != crc:
+        raise ValueError("data failed its checksum")
+
+    arrays = {}
+    try:
+        for i in range(n_arrays):
+            entry = _ARRAY_ENTRY.unpack_from(data, _HEADER.size + i * _ARRAY_ENTRY.size)
+            name, dtype, ndim, dim0, dim1, offset = entry
+            name, dtype = name.rstrip(b'\0').decode('ascii'), np.dtype(dtype.rstrip(b'\0').decode('ascii'))
+            array_shape = (dim0, dim1)[:ndim]
+            count = int(np.prod(array_shape))
+            arrays[name] = np.frombuffer(data, dtype=dtype, count=count,
+                                         offset=offset if count else 0).reshape(array_shape)
+    except (struct.error, TypeError) as exc:
+        # Untrusted data: report a truncated table or an unknown dtype like any other corruption
+        raise ValueError(f"data has a malformed array table: {exc}") from exc
+    return kind.rstrip(b'\0').decode('ascii'), (height, width), arrays
+
+def load_encoded(path, mmap=True, verify=True):
+    """
+    Load an encoded image saved by `save_encoded`.
+
+    Parameters:
+    - path (str): The file to read.
+    - mmap (bool, optional): If True, the arrays are read-only `np.memmap` views of the file
+      and no array data is copied. Otherwise the arrays are read into memory. Defaults to True.
+    - verify (bool, optional): If True, the CRC-32 stored in the header is checked against
+      the file contents. Defaults to True.
+
+    Returns:
+    - tuple: `(kind, shape, arrays)`, the encoding kind string, the (height, width) of the
+      image and a dict mapping array names to numpy arrays.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size or header[:4] != MAGIC:
+            raise ValueError(f"{path} is not an encoded image file")
+        magic, version, n_arrays, kind, height, width, crc = _HEADER.unpack(header)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"{path} has format version {version}, expected {FORMAT_VERSION}")
+        table = f.read(_ARRAY_ENTRY.size * n_arrays)
+        data = None if mmap else f.read()
+
+    if verify:
+        body = np.memmap(path, dtype=np.uint8, mode='r', offset=_HEADER.size) if mmap else table + data
+        if zlib.crc32(body) != crc:
+            raise ValueError(f"{path} failed its checksum")
+
+    arrays = {}
+    for i in range(n_arrays):
+        name, dtype, ndim, dim0, dim1, offset = _ARRAY_ENTRY.unpack_from(table, i * _ARRAY_ENTRY.size)
+        name, dtype = name.rstrip(b'\0').decode('ascii'), np.dtype(dtype.rstrip(b'\0').decode('ascii'))
+        array_shape = (dim0, dim1)[:ndim]
+        if mmap and dim0 * max(dim1, 1) > 0:
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=array_shape)
+        else:
+            start = offset - _HEADER.size - len(table)
+            count = int(np.prod(array_shape))
+            arrays[name] = np.frombuffer(data or b'', dtype=dtype, count=count,
+                                         offset=start if count else 0).reshape(array_shape)
+    return kind.rstrip(b'\0').decode('ascii'), (height, width), arrays
+
+def convert_json(json_path, out_path, kind, shape):
+    """
+    Convert an image saved by the JSON path of `main.py` to the binary container.
+
+    Parameters:
+    - json_path (str): The JSON file holding the encoded array as nested lists.
+    - out_path (str): The binary file to write.
+    - kind (str): 'rle' for microscope files or 'sparse' for dye sensor files.
+    - shape (tuple): The (height, width) of the encoded image.
+
+    Returns:
+    - int: The number of bytes written.
+
+    Note:
+    - The array is stored with the smallest unsigned integer dtype that holds its values.
+    """
+    with open(json_path) as f:
+        array = np.asarray(json.load(f))
+    return save_encoded(out_path, kind, shape, {kind: compact(array)})
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert JSON encoded images to the binary container.")
+    parser.add_argument('json_path')
+    parser.add_argument('out_path')
+    parser.add_argument('--kind', choices=('rle', 'sparse'), required=True)
+    parser.add_argument('--shape', type=int, nargs=2, default=(1000, 1000), metavar=('HEIGHT', 'WIDTH'))
+    args = parser.parse_args()
+    size = convert_json(args.json_path, args.out_path, args.kind, tuple(args.shape))
+    print(f"Wrote {size} bytes to {args.out_path}")
@@ -1,7 +1,7 @@
 import os
-import matplotlib.pyplot as plt
 
 def visualize_image(image, title, output_dir=None, filename=None):
+    import matplotlib.pyplot as plt
     plt.figure(figsize=(10, 10))
     plt.imshow(image, cmap='gray') 
     plt.title(title)